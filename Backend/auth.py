@@ -50,6 +50,15 @@ def extract_token(
         return token_q.strip()
     return None
 
+def match_employee_id(raw: str) -> Optional[str]:
+    """
+    รับทั้ง 6–7 หลัก และเผื่อ EN นำหน้า (raw ต้อง strip/upper มาแล้ว)
+    "EN1234567" / "1234567" → "1234567" ; ไม่ใช่เลขล้วน ASCII 6–7 หลัก → None
+    ตัด EN + เช็คในขั้นเดียว ด้วย str method ระดับ C ไม่ต้องผ่าน regex
+    """
+    s = raw[2:] if raw.startswith("EN") else raw
+    return s if 6 <= len(s) <= 7 and s.isascii() and s.isdigit() else None
+
 def find_user(db: Session, employee_id: str) -> Optional[User]:
     return db.query(User).filter(User.employee_id == employee_id).first()
 
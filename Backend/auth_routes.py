@@ -1,12 +1,12 @@
 # backend/auth_routes.py
 from __future__ import annotations
 
-import re
 from datetime import datetime
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from jose import jwt  # ใช้สำหรับอ่าน claims โดยไม่ต้อง verify เพื่อดึง exp
 
 from db import get_db
@@ -15,7 +15,7 @@ from schemas import (
     LoginIn,
     LoginOut,
     RefreshIn,
-    UserOut,
+    userout_for,
 )
 from auth import (
     create_access_token,                 # fallback
@@ -23,19 +23,17 @@ from auth import (
     create_refresh_token,
     decode_refresh_token,
     get_user_from_header_or_query,
+    match_employee_id,
 )
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-# รับทั้ง 6–7 หลัก และเผื่อ EN นำหน้า
-_DIGITS_RE = re.compile(r"^\d{6,7}$")
-
 
 @router.post("/login", response_model=LoginOut)
 def login(payload: LoginIn, db: Session = Depends(get_db)):
     raw = payload.employee_id.strip().upper()
-    emp = re.sub(r"^EN", "", raw)
-    if not _DIGITS_RE.match(emp):
+    emp = match_employee_id(raw)
+    if emp is None:
         raise HTTPException(status_code=422, detail="Invalid Employee ID (6–7 digits)")
 
     user = db.query(User).filter(User.employee_id == emp).first()
@@ -49,14 +47,20 @@ def login(payload: LoginIn, db: Session = Depends(get_db)):
     # อัปเดต last_login ถ้ายืนยันโปรไฟล์แล้ว
     needs_confirm = not bool(user.confirmed)
     if not needs_confirm:
-        user.last_login_at = datetime.utcnow()
-        db.add(user); db.commit(); db.refresh(user)
-
+        # UPDATE ตรงคอลัมน์เดียว แล้ว sync ค่าในออบเจ็กต์เอง → ไม่ต้อง refresh (SELECT ซ้ำ)
+        now = datetime.utcnow()
+        (db.query(User)
+           .filter(User.id == user.id)
+           .update({User.last_login_at: now}, synchronize_session=False))
+        db.commit()
+        set_committed_value(user, "last_login_at", now)
+
+    user_out = userout_for(user)
     return LoginOut(
         access_token=access_token,
         refresh_token=refresh_token,
         token_type="bearer",
-        user=UserOut.model_validate(user),
+        user=user_out,
         needs_confirm=needs_confirm,
     )
 
@@ -104,7 +108,7 @@ def me(request: Request, user: User = Depends(get_user_from_header_or_query)):
     - server_time: เวลาปัจจุบันฝั่งเซิร์ฟเวอร์ (unix seconds)
     NOTE: ไม่ใส่ response_model เพื่อเปิดทางให้ฝั่ง FE รับ field เสริมได้อิสระ
     """
-    user_out = UserOut.model_validate(user).model_dump(mode="json")
+    user_out = userout_for(user).model_dump(mode="json")
     token_exp = _read_token_exp_from_auth_header(request)
     server_time = int(datetime.utcnow().timestamp())
     return {
@@ -4,7 +4,7 @@ from __future__ import annotations
 import os, re, json, tempfile, subprocess, base64, logging
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict
+from typing import List, Optional, Tuple, Dict, Set
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Response, Body
 from fastapi.responses import StreamingResponse
@@ -118,11 +118,14 @@ except Exception:
     _HAS_MANIFEST = False
 
 # ---------- siblings / cleanup helpers ----------
+_GCODE_EXT_RE = re.compile(r"\.(gcode|gco|gc)$", re.I)
+
 def _preview_keys_from_gcode(gk: str | None) -> list[str]:
     """คืนรายชื่อ key preview ทั้งสองแบบ (.preview.png และ _preview.png)"""
-    if not gk or not re.search(r"\.(gcode|gco|gc)$", gk, flags=re.I):
+    m = _GCODE_EXT_RE.search(gk) if gk else None
+    if not m:
         return []
-    base = re.sub(r"\.(gcode|gco|gc)$", "", gk, flags=re.I)
+    base = gk[:m.start()]
     return [f"{base}.preview.png", f"{base}_preview.png"]
 
 def _manifest_key_for_safe(gk: str | None) -> str | None:
@@ -195,6 +198,7 @@ AUTO_MANIFEST_ON_FINALIZE = str(os.getenv("AUTO_MANIFEST_ON_FINALIZE", "1")).low
 NAME_REGEX = re.compile(r"^[A-Za-z0-9._-]+_V\d+$")
 _HEX_PREFIX = re.compile(r"^[0-9a-f]{8,}[_-](.+)", re.I)
 _V_RE = re.compile(r"^(?P<stem>.+?)_v(?P<n>\d+)(?:\.(?P<ext>[^.]+))?$", re.I)
+_V_SUFFIX_RE = re.compile(r"_v(\d+)$", re.I)
 
 # ---------- PrusaSlicer env ----------
 PRUSA_SLICER_BIN = os.getenv("PRUSA_SLICER_BIN", "").strip()
@@ -270,18 +274,27 @@ def _normalize_name_for_check(name: str, ext: str="gcode", require_pattern: bool
         if not NAME_REGEX.match(base): return nn,"invalid_format"
     return nn,None
 
+# ทน schema ต่างกัน: name_low / name / filename — schema ไม่เปลี่ยนระหว่างรัน → เลือกคอลัมน์ครั้งเดียวตอน import
+if hasattr(StorageFile, "name_low"): _NAME_LOW_COL=getattr(StorageFile, "name_low")
+elif hasattr(StorageFile, "name"): _NAME_LOW_COL=func.lower(getattr(StorageFile, "name"))
+else: _NAME_LOW_COL=func.lower(StorageFile.filename)
+
 def _exists_name_low(db: Session, name: str) -> bool:
-    """ทน schema ต่างกัน: name_low / name / filename"""
     nl = _name_low(name)
     try:
-        if hasattr(StorageFile, "name_low"):
-            return db.query(StorageFile.id).filter(getattr(StorageFile, "name_low") == nl).first() is not None
-        if hasattr(StorageFile, "name"):
-            return db.query(StorageFile.id).filter(func.lower(getattr(StorageFile, "name")) == nl).first() is not None
-        return db.query(StorageFile.id).filter(func.lower(StorageFile.filename) == nl).first() is not None
+        return db.query(StorageFile.id).filter(_NAME_LOW_COL == nl).first() is not None
     except Exception:
         return False
 
+def _names_low_with_prefix(db: Session, prefix: str) -> Set[str]:
+    """ชื่อ (lower) ทั้งหมดที่ขึ้นต้นด้วย prefix ใน query เดียว — ใช้ไล่หาเลขเวอร์ชันว่างแทนการถาม _exists_name_low ทีละชื่อ
+    (_ / % ใน prefix ทำให้ LIKE กว้างขึ้นเท่านั้น ผลสุดท้ายเช็คด้วย set แบบตรงตัวอยู่แล้ว)"""
+    pl=_name_low(prefix)
+    try:
+        return {r[0] for r in db.query(_NAME_LOW_COL).filter(_NAME_LOW_COL.like(f"{pl}%")).all() if r[0]}
+    except Exception:
+        return set()
+
 def _split_version(fullname: str) -> tuple[str, Optional[int], Optional[str]]:
     name=(fullname or "").strip(); m=_V_RE.match(name)
     if not m:
@@ -296,9 +309,10 @@ def _bump_until_free(db: Session, desired: str) -> str:
     stem, n, ext = _split_version(desired)
     if ext is None and "." in desired: ext=desired.rsplit(".",1)[-1]
     start=(n+1) if n is not None else 2
+    taken=_names_low_with_prefix(db, f"{stem}_V")
     for i in range(start, start+500):
         cand=f"{stem}_V{i}.{ext or 'gcode'}"
-        if not _exists_name_low(db, cand): return cand
+        if _name_low(cand) not in taken: return cand
     return desired
 
 # ---------- S3 client ----------
@@ -449,6 +463,8 @@ def list_catalog(
         n=(name or "").lower(); return ("preview" in n) and n.endswith((".webp",".png",".jpg",".jpeg"))
     cat_prefix = normalize_s3_prefix(f"catalog/{model.title()}/") if model else "catalog/"
     objs=list_objects(Prefix=cat_prefix) or []
+    # key ทั้งหมดใต้ prefix (ก่อนกรอง q) → เช็คว่ามีไฟล์พรีวิวจริงได้โดยไม่ต้อง HEAD ทีละ object
+    listed_keys={o.get("Key") for o in objs}
     groups: Dict[str, Dict]={}
     for o in objs:
         key=o.get("Key") or ""
@@ -471,6 +487,28 @@ def list_catalog(
         elif fname_low.endswith(".json"):
             entry["meta_key"]=key
 
+    # uploader ของทุก entry: ดึง StorageFile/User แบบ IN ทีละก้อน แทน 2 query ต่อ entry
+    uploader_by_key: Dict[str, Dict]={}
+    try:
+        lookup_keys=list({(e.get("gcode_key") or e.get("first_key")) for e in groups.values()} - {None})
+        emp_by_key: Dict[str, str]={}
+        for i in range(0, len(lookup_keys), 500):
+            for ok, emp in (db.query(StorageFile.object_key, StorageFile.employee_id)
+                            .filter(StorageFile.object_key.in_(lookup_keys[i:i+500]))
+                            .order_by(StorageFile.id.asc()).all()):
+                emp_by_key.setdefault(ok, emp)
+        emps=list(set(emp_by_key.values()))
+        users: Dict[str, User]={}
+        for i in range(0, len(emps), 500):
+            for u in db.query(User).filter(User.employee_id.in_(emps[i:i+500])).all():
+                users.setdefault(u.employee_id, u)
+        for ok, emp in emp_by_key.items():
+            u=users.get(emp)
+            uploader_by_key[ok]={"employee_id":(u.employee_id if u else emp),
+                                 "name":(u.name if u and u.name else emp),
+                                 "email":(u.email if u else None)}
+    except Exception: uploader_by_key={}
+
     items: List[Dict]=[]
     for e in groups.values():
         rep_key=e["gcode_key"] or e["first_key"]
@@ -485,23 +523,12 @@ def list_catalog(
                 content_type=h.get("ContentType") or content_type
             except Exception: pass
         preview_url=None
-        if with_urls and e.get("preview_key"):
+        if with_urls and e.get("preview_key") in listed_keys:
             try:
-                _ = head_object(e["preview_key"])
                 preview_url=presign_get(e["preview_key"])
             except Exception:
                 preview_url=None
-        uploader=None
-        lookup_key=e.get("gcode_key") or e.get("first_key")
-        if lookup_key:
-            try:
-                row=db.query(StorageFile).filter(StorageFile.object_key==lookup_key).first()
-                if row:
-                    u=db.query(User).filter(User.employee_id==row.employee_id).first()
-                    uploader={"employee_id":(u.employee_id if u else row.employee_id),
-                              "name":(u.name if u and u.name else row.employee_id),
-                              "email":(u.email if u else None)}
-            except Exception: uploader=None
+        uploader=uploader_by_key.get(e.get("gcode_key") or e.get("first_key"))
         ext=None; rep_last=rep_key.split("/")[-1]
         if "." in rep_last: ext=rep_last.rsplit(".",1)[-1].lower()
         manifest_url=None
@@ -1037,12 +1064,12 @@ def validate_name(payload: StorageValidateNameIn, db: Session=Depends(get_db), _
     exists=_exists_name_low(db, normalized)
     if exists:
         def _suggest_versions(base_no_ext: str, ext: str, db: Session, limit: int=5)->List[str]:
-            suggestions=[]; m=re.search(r"_v(\d+)$", base_no_ext, re.I)
-            start=int(m.group(1))+1 if m else 2; stem=re.sub(r"_v\d+$","",base_no_ext, flags=re.I) or base_no_ext
-            i=start
+            suggestions=[]; m=_V_SUFFIX_RE.search(base_no_ext)
+            start=int(m.group(1))+1 if m else 2; stem=(base_no_ext[:m.start()] if m else base_no_ext) or base_no_ext
+            i=start; taken=_names_low_with_prefix(db, f"{stem}_V")
             while len(suggestions)<limit and i<start+50:
                 cand=f"{stem}_V{i}.{ext}"
-                if not _exists_name_low(db, cand): suggestions.append(cand)
+                if _name_low(cand) not in taken: suggestions.append(cand)
                 i+=1
             return suggestions
         return StorageValidateNameOut(ok=False, reason="duplicate", normalized=normalized, exists=True,
@@ -1054,7 +1081,8 @@ def search_names(q: str=Query("", description="keyword (case-insensitive)"), lim
                  db: Session=Depends(get_db), _me: User=Depends(get_current_user)):
     qq=(q or "").strip().lower()
     if not qq: return StorageSearchNamesOut(items=[])
-    rows=(db.query(StorageFile.name).filter(func.lower(StorageFile.name).like(f"%{qq}%"))
+    # name_low คำนวณไว้แล้วตอนเขียน → ไม่ต้องเรียก lower() ต่อแถวใน SQL
+    rows=(db.query(StorageFile.name).filter(_NAME_LOW_COL.like(f"%{qq}%"))
           .order_by(StorageFile.name.asc()).limit(limit).all())
     return StorageSearchNamesOut(items=[r[0] for r in rows if r and r[0]])
 
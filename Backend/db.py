@@ -4,7 +4,7 @@ from __future__ import annotations
 import os
 from typing import Generator
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import declarative_base   # ★ เพิ่มบรรทัดนี้
@@ -14,27 +14,67 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./users.db").strip()
 # ★ ประกาศ Base กลางให้ทุก model ใช้ร่วมกัน
 Base = declarative_base()
 
+# SQLite: WAL ให้ reader ไม่ต้องรอ writer + synchronous=NORMAL (fsync ตอน checkpoint ไม่ใช่ทุก commit)
+# journal_mode ติดอยู่กับไฟล์ DB ถาวร ที่เหลือเป็นค่าต่อ connection → ตั้งทุกครั้งที่เปิด
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").strip().upper()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def sqlite_tune(dbapi_conn, _record=None) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        if SQLITE_JOURNAL_MODE:
+            cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        if SQLITE_SYNCHRONOUS:
+            cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cur.close()
+
+
 if DATABASE_URL.startswith("sqlite"):
+    # SQLite: เปิด/ปิดไฟล์ต่อ session ถูกอยู่แล้ว และ connection เดียวแชร์ข้าม thread ไม่ได้ → NullPool
     engine = create_engine(
         DATABASE_URL,
         connect_args={"check_same_thread": False},
         poolclass=NullPool,
         future=True,
     )
+    event.listen(engine, "connect", sqlite_tune)
+    POOL_SETTINGS = {
+        "poolclass": "NullPool",
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+    }
 else:
-    pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
-    max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))
-    pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # pool_use_lifo: ใช้ connection ที่เพิ่งคืนก่อน → ตัวที่ว่างนานถูก recycle/ปิดเองช่วงเงียบ
+    POOL_SETTINGS = {
+        "poolclass": "QueuePool",
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True,
+        "pool_use_lifo": True,
+    }
 
     engine = create_engine(
         DATABASE_URL,
         future=True,
-        pool_pre_ping=True,
-        pool_size=pool_size,
-        max_overflow=max_overflow,
-        pool_recycle=pool_recycle,
+        **{k: v for k, v in POOL_SETTINGS.items() if k != "poolclass"},
     )
 
+def sqlite_optimize() -> None:
+    """PRAGMA optimize: ให้ SQLite ANALYZE เฉพาะตารางที่สถิติน่าจะเก่า (ถูก ไม่ใช่ ANALYZE ทั้ง DB)
+    เรียกหลังสร้างตาราง/index ใหม่ และตอนปิดแอป — DB อื่นที่ไม่ใช่ SQLite ข้าม"""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+
+
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
@@ -8,7 +8,6 @@ from tempfile import SpooledTemporaryFile
 
 import boto3
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
-from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from auth import get_confirmed_user
@@ -151,14 +150,12 @@ async def upload_file(
         # ถ้าเมาท์ StaticFiles ไว้ที่ /uploads
         url = f"/uploads/{staging_key}"
 
-    return JSONResponse(
-        {
-            "ok": True,
-            "fileId": staging_key,  # FE คาดหวังคีย์ staging/* เพื่อนำไป complete
-            "filename": orig_name,
-            "content_type": content_type,
-            "size": total,
-            "url": url,
-            "uploaded_at": datetime.utcnow().isoformat() + "Z",
-        }
-    )
+    return {
+        "ok": True,
+        "fileId": staging_key,  # FE คาดหวังคีย์ staging/* เพื่อนำไป complete
+        "filename": orig_name,
+        "content_type": content_type,
+        "size": total,
+        "url": url,
+        "uploaded_at": datetime.utcnow().isoformat() + "Z",
+    }
@@ -0,0 +1,60 @@
+# backend/http_pool.py
+"""
+httpx.AsyncClient แบบใช้ซ้ำ (keep-alive) ผูกกับ event loop หลักของแอป
+
+- client ตัวจริงใช้ร่วมกันเฉพาะบน loop ของแอป (ตั้งใน lifespan ผ่าน bind_app_loop) → ไม่ต้องเปิด/ปิด TCP ทุกครั้ง
+- งาน background บางตัว (_spawn/_bgcall) รันด้วย asyncio.run ใน thread แยก = คนละ loop และ loop ตายเร็ว
+  connection pool ข้าม loop ไม่ได้ → ได้ client ชั่วคราว (ปิดทันทีหลังใช้) แทนเสมอ
+  ไม่ผูก client ตัวร่วมกับ loop พวกนี้ (ไม่งั้นค้างไม่มีใครปิด)
+- เพราะ client ตัวร่วมถูกแตะจาก thread ของ loop แอปเท่านั้น จึงไม่มี thread อื่นมาสร้าง/สลับแข่งกัน
+- ยังไม่ได้ bind (เช่นสคริปต์ที่ไม่ผ่าน lifespan) → ทุกครั้งเป็น client ชั่วคราว
+"""
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional
+
+import httpx
+
+_ALL: List["SharedAsyncClient"] = []
+_APP_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def bind_app_loop() -> None:
+    """เรียกตอน startup ของแอป (ภายใน loop หลัก)"""
+    global _APP_LOOP
+    _APP_LOOP = asyncio.get_running_loop()
+
+
+class SharedAsyncClient:
+    def __init__(self, **client_kwargs: Any):
+        self._kwargs = client_kwargs
+        self._client: Optional[httpx.AsyncClient] = None
+        _ALL.append(self)
+
+    @asynccontextmanager
+    async def client(self) -> AsyncIterator[httpx.AsyncClient]:
+        if asyncio.get_running_loop() is _APP_LOOP:
+            if self._client is None or self._client.is_closed:
+                self._client = httpx.AsyncClient(**self._kwargs)
+            yield self._client
+            return
+        async with httpx.AsyncClient(**self._kwargs) as tmp:
+            yield tmp
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+async def close_all() -> None:
+    """เรียกตอน shutdown ของแอป (บน loop หลัก)"""
+    global _APP_LOOP
+    for c in _ALL:
+        try:
+            await c.aclose()
+        except Exception:
+            pass
+    _APP_LOOP = None
@@ -2,13 +2,16 @@
 from __future__ import annotations
 
 import os
-import re
+import json
 import time
+import asyncio
 import logging
+import threading
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Set, Optional, List
-from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Dict, Optional, List, Tuple, Union
+from contextlib import asynccontextmanager, contextmanager
 
 from dotenv import load_dotenv
 
@@ -25,24 +28,39 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 )
 
+# uvloop (ไม่มีบน Windows): uvicorn[standard] ใช้กับ loop หลักอยู่แล้ว แต่ตั้ง policy ไว้เองด้วย
+# ให้ asyncio.run ใน thread ของ _spawn/_bgcall และการรันผ่าน runner อื่นได้ uvloop เหมือนกัน
+try:
+    import uvloop
+    if not isinstance(asyncio.get_event_loop_policy(), uvloop.EventLoopPolicy):
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 # ---------------- FastAPI / Std ----------------
 from fastapi import (
-    FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect,
-    Query, APIRouter
+    FastAPI, Depends, HTTPException, WebSocket,
+    Query, APIRouter, BackgroundTasks
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Route
 
 # ---------------- DB / Models / Auth ----------------
+from sqlalchemy import inspect, select
 from sqlalchemy.orm import Session
-from db import Base, engine, get_db, SessionLocal
+from sqlalchemy.orm.attributes import set_committed_value
+from db import Base, engine, get_db, SessionLocal, POOL_SETTINGS as DB_POOL_SETTINGS, sqlite_optimize
 import models  # สำคัญ: โหลดโมเดลให้ Base เห็นตารางทั้งหมด
 from models import User
-from schemas import LoginIn, LoginOut, UserOut, UpdateMeIn, RefreshIn, RefreshOut
+from schemas import LoginIn, LoginOut, UserOut, UpdateMeIn, RefreshIn, RefreshOut, userout_for, userout_json_for
 from auth import (
     create_access_token, create_refresh_token, decode_refresh_token,
-    get_current_user, decode_token
+    get_current_user, decode_token, match_employee_id
 )
 
 # ---------------- Always-on Routers ----------------
@@ -51,6 +69,7 @@ from printer_status import router as printer_status_router
 from print_queue import router as queue_router
 from print_history import router as history_router
 from files_api import router as files_router  # legacy /files/*
+from http_pool import bind_app_loop, close_all as close_http_clients
 
 # ---------------- Storage backend selector ----------------
 STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3").lower().strip()
@@ -150,7 +169,46 @@ except Exception as e:
 API_TITLE   = "3D Printer Backend (FastAPI)"
 API_VERSION = "v2"
 
-app = FastAPI(title=API_TITLE, version=API_VERSION)
+# JSON response: ใช้ orjson ถ้าติดตั้งไว้ (เร็วกว่า json ของ stdlib มาก) ไม่มีก็ใช้ JSONResponse ปกติ
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as DefaultJSONResponse
+except ImportError:
+    orjson = None
+    from fastapi.responses import JSONResponse as DefaultJSONResponse
+
+def _orjson_default(obj):
+    # pydantic model ที่ซ้อนอยู่ใน message; ชนิดอื่นที่ orjson ไม่รู้จักส่งต่อให้ jsonable_encoder
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    return jsonable_encoder(obj)
+
+def _ws_encode(message: dict) -> str:
+    """encode message ของ WebSocket เป็น JSON text (orjson ถ้ามี)"""
+    if orjson is not None:
+        return orjson.dumps(message, default=_orjson_default).decode()
+    return json.dumps(jsonable_encoder(message), separators=(",", ":"), ensure_ascii=False)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # startup/shutdown รวมที่เดียว ลำดับชัดเจน (แทน @app.on_event ที่ deprecated)
+    bind_app_loop()   # HTTP client keep-alive ตัวร่วมผูกกับ loop นี้เท่านั้น
+    _startup()
+    try:
+        yield
+    finally:
+        await close_http_clients()
+        try:
+            sqlite_optimize()
+        except Exception as e:
+            logging.warning("[shutdown] PRAGMA optimize failed: %r", e)
+
+app = FastAPI(
+    title=API_TITLE,
+    version=API_VERSION,
+    default_response_class=DefaultJSONResponse,
+    lifespan=lifespan,
+)
 
 # ---------------- CORS ----------------
 def _parse_origins(val: str) -> List[str]:
@@ -183,9 +241,90 @@ app.add_middleware(
 UPLOADS_DIR = os.getenv("UPLOADS_DIR", "uploads")
 UPLOADS_DIR_ABS = str((BACKEND_DIR / UPLOADS_DIR).resolve())
 
-@app.on_event("startup")
-def startup():
-    Base.metadata.create_all(bind=engine)
+# INIT_DB=0 → ไม่แตะ schema เลย (เช่นใช้ alembic จัดการเอง)
+INIT_DB = os.getenv("INIT_DB", "1").strip().lower() in ("1", "true", "yes", "on")
+
+# create_all ไม่แตะตารางที่มีอยู่แล้ว → DB เดิมต้องแปลง/เติมเองตอน startup
+# index ที่เพิ่มเข้า model ภายหลัง (ตารางเดิมยังไม่มี)
+_LATE_INDEXES = frozenset({
+    "ix_notif_targets_emp_unread",
+    "ix_print_jobs_printer_status_started",
+    "ix_print_jobs_gcode_status",
+})
+
+def _rebuild_notification_targets(conn) -> bool:
+    """SQLite: notification_targets รุ่นเก่า (id rowid) → PK ผสม (employee_id, notification_id) WITHOUT ROWID"""
+    row = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name='notification_targets'"
+    ).first()
+    if row is None or "WITHOUT ROWID" in (row[0] or "").upper():
+        return False
+    conn.exec_driver_sql("ALTER TABLE notification_targets RENAME TO notification_targets_old")
+    # index เดิมติดไปกับตารางที่ rename และชื่อจะชนกับของตารางใหม่ → ลบก่อน
+    old_indexes = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='notification_targets_old' AND sql IS NOT NULL"
+    ).scalars().all()
+    for name in old_indexes:
+        conn.exec_driver_sql(f'DROP INDEX "{name}"')
+    models.NotificationTarget.__table__.create(conn)
+    # ตารางเดิมมีคู่ (employee_id, notification_id) ซ้ำได้ → DISTINCT + OR IGNORE เก็บแถวเดียว
+    # (เรียงแถวที่อ่านแล้วขึ้นก่อน ถ้าซ้ำกันแล้วมีแถวไหนอ่านแล้ว ถือว่าอ่านแล้ว)
+    conn.exec_driver_sql(
+        "INSERT OR IGNORE INTO notification_targets (employee_id, notification_id, read_at) "
+        "SELECT DISTINCT employee_id, notification_id, read_at FROM notification_targets_old "
+        "WHERE employee_id IS NOT NULL AND notification_id IS NOT NULL "
+        "ORDER BY read_at IS NULL"
+    )
+    conn.exec_driver_sql("DROP TABLE notification_targets_old")
+    logging.info("[db] notification_targets rebuilt: PK (employee_id, notification_id) WITHOUT ROWID")
+    return True
+
+def _ensure_late_indexes(conn) -> bool:
+    existing = {
+        ix["name"]
+        for t in ("notification_targets", "print_jobs")
+        for ix in inspect(conn).get_indexes(t)
+    }
+    created = False
+    for table in Base.metadata.sorted_tables:
+        for ix in table.indexes:
+            if ix.name in _LATE_INDEXES and ix.name not in existing:
+                ix.create(conn)
+                created = True
+    return created
+
+# index ที่ model เลิกใช้แล้ว (มีตัวใหม่ครอบแทน) แต่ DB เดิมยังมีอยู่ → เสียค่าเขียนทุก INSERT/UPDATE ฟรี ๆ
+_DROPPED_INDEXES = (
+    ("print_jobs", "ix_print_jobs_printer_status"),   # → ix_print_jobs_printer_status_started
+    ("storage_files", "ix_storage_files_key"),          # ซ้ำกับ uq_storage_files_object_key
+)
+
+def _drop_stale_indexes(conn) -> bool:
+    insp = inspect(conn)
+    dropped = False
+    for table, name in _DROPPED_INDEXES:
+        if any(ix["name"] == name for ix in insp.get_indexes(table)):
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+            dropped = True
+    return dropped
+
+def _init_db():
+    # warm start ตารางครบแล้ว → อ่านรายชื่อตารางครั้งเดียว ไม่ต้อง has_table ทีละตาราง
+    existing = set(inspect(engine).get_table_names())
+    missing = [t for t in Base.metadata.sorted_tables if t.name not in existing]
+    if missing:
+        Base.metadata.create_all(bind=engine, tables=missing)
+    with engine.begin() as conn:
+        rebuilt = engine.dialect.name == "sqlite" and _rebuild_notification_targets(conn)
+        indexed = _ensure_late_indexes(conn)
+        dropped = _drop_stale_indexes(conn)
+    if missing or rebuilt or indexed or dropped:
+        # index ใหม่ยังไม่มีสถิติ → planner เลือกแผนผิดได้จนกว่าจะ analyze
+        sqlite_optimize()
+
+def _startup():
+    if INIT_DB:
+        _init_db()
     if STORAGE_BACKEND == "local":
         os.makedirs(UPLOADS_DIR_ABS, exist_ok=True)
     logging.info(
@@ -193,15 +332,36 @@ def startup():
         STORAGE_BACKEND, PREVIEW_BACKEND, GPU_PREVIEW_ENABLED, allow_origins
     )
 
+# FileResponse อ่านไฟล์ทีละ chunk ผ่าน thread (ค่าเริ่มต้น 64KB) → G-code หลาย MB ที่ viewer โหลด
+# จะ hop ไป thread หลายร้อยครั้ง ขยาย chunk ให้ใหญ่ขึ้น (Range/ETag/304 ยังเป็นของ StaticFiles เดิม)
+UPLOADS_CHUNK_SIZE = int(os.getenv("UPLOADS_CHUNK_SIZE", str(1024 * 1024)))
+
+class _UploadsFiles(StaticFiles):
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        if isinstance(response, FileResponse):
+            response.chunk_size = UPLOADS_CHUNK_SIZE
+        return response
+
 if STORAGE_BACKEND == "local":
-    app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR_ABS), name="uploads")
+    app.mount("/uploads", _UploadsFiles(directory=UPLOADS_DIR_ABS), name="uploads")
 
 # ---------------- Include Routers (root + /api) ----------------
+def _all_api_prefixed(router) -> bool:
+    # scan เดียว หยุดทันทีที่เจอ path ที่ไม่ได้ขึ้นต้น /api/
+    return all(r.path.startswith("/api/") for r in getattr(router, "routes", ()) if getattr(r, "path", None))
+
+# สำเนา /api/* ของทุก router รวมไว้ใน router เดียว แล้ว include ต่อท้ายทีเดียว
+# → route จริงที่ root เรียงติดกันก่อน request ปกติไม่ต้องไล่ผ่าน route สำเนาที่แทรกอยู่ระหว่างกลาง
+api_mirror = APIRouter(prefix="/api", include_in_schema=False)
+
 def include_both(router, *, name: str):
     if router is None:
         logging.warning("[main] skip include: %s (router is None)", name); return
     app.include_router(router)
-    app.include_router(router, prefix="/api", include_in_schema=False)
+    # router ที่ path เป็น /api/* อยู่แล้ว ไม่ต้องซ้อนเป็น /api/api/* (เพิ่มแต่ route ให้ match ทิ้ง)
+    if not _all_api_prefixed(router):
+        api_mirror.include_router(router)
 
 include_both(notifications_router, name="notifications")
 include_both(printer_status_router, name="printer_status")
@@ -215,6 +375,7 @@ include_both(preview_router, name="preview")
 include_both(files_raw_router, name="files_raw")
 # ✅ ใส่ router สำหรับสร้าง/รีเจนรูปพรีวิว (.preview.png) ไว้โฟลเดอร์เดียวกับ G-code
 include_both(preview_regen_router, name="preview_regen")
+app.include_router(api_mirror)
 
 # ---------- proxy /storage/catalog และ /api/storage/catalog ----------
 def _resolve_catalog_handler():
@@ -284,47 +445,83 @@ def storage_catalog_api_proxy(
 # ---------------- /api/gcode/meta ----------------
 gcode_router = APIRouter(prefix="/api/gcode", tags=["gcode"])
 
+# เมตาของไฟล์ G-code ไม่เปลี่ยนหลังอัปโหลด → cache ตาม object_key (FE viewer ถามซ้ำบ่อย)
+# ผลที่ว่างทั้งหมด (อ่านไม่ได้/ยังไม่มีไฟล์) ไม่ cache เผื่อไฟล์เพิ่งขึ้นทีหลัง
+_GCODE_META_TTL = float(os.getenv("GCODE_META_CACHE_TTL", "3600"))
+_GCODE_META_CACHE_MAX = 1024
+_gcode_meta_cache: Dict[str, Tuple[float, dict]] = {}
+
 @gcode_router.get("/meta")
 def gcode_meta(object_key: str):
     key = (object_key or "").strip()
     if not key.lower().endswith((".gcode", ".gco", ".gc")):
         raise HTTPException(status_code=400, detail="object_key must be a G-code file")
+    now = time.monotonic()
+    hit = _gcode_meta_cache.get(key)
+    if hit and now - hit[0] < _GCODE_META_TTL:
+        return hit[1]
+
     meta = meta_from_gcode_object(key) or {}
-    return {
+    out = {
         "time_min":   meta.get("time_min"),
         "time_text":  meta.get("time_text"),
         "filament_g": meta.get("filament_g"),
     }
+    if any(v is not None for v in out.values()):
+        if len(_gcode_meta_cache) >= _GCODE_META_CACHE_MAX:
+            _gcode_meta_cache.pop(next(iter(_gcode_meta_cache)), None)
+        _gcode_meta_cache[key] = (now, out)
+    return out
 
 app.include_router(gcode_router)
 
 # ---------------- WebSocket Hub ----------------
 class WSManager:
+    # copy-on-write: connect/disconnect สร้าง tuple ใหม่ ส่วนฝั่งส่ง (เรียกบ่อยกว่ามาก) อ่าน tuple ได้เลย
+    # tuple ที่ได้ไปแล้วไม่มีวันถูกแก้ → วน/await ระหว่างทางได้โดยไม่ต้อง copy
     def __init__(self):
-        self.active_by_emp: Dict[str, Set[WebSocket]] = {}
+        self.active_by_emp: Dict[str, Tuple[WebSocket, ...]] = {}
 
     async def connect(self, emp: str, ws: WebSocket):
-        self.active_by_emp.setdefault(emp, set()).add(ws)
+        conns = self.active_by_emp.get(emp, ())
+        if ws not in conns:
+            self.active_by_emp[emp] = conns + (ws,)
 
     def disconnect(self, emp: str, ws: WebSocket):
         conns = self.active_by_emp.get(emp)
-        if not conns:
+        if not conns or ws not in conns:
             return
-        conns.discard(ws)
-        if not conns:
+        rest = tuple(c for c in conns if c is not ws)
+        if rest:
+            self.active_by_emp[emp] = rest
+        else:
             self.active_by_emp.pop(emp, None)
 
-    async def send_to_emp(self, emp: str, message: dict):
-        for ws in list(self.active_by_emp.get(emp, set())):
-            try:
-                await ws.send_json(jsonable_encoder(message))
-            except WebSocketDisconnect:
-                self.disconnect(emp, ws)
-            except Exception:
+    async def send_to_emp(self, emp: str, message: Union[str, dict]):
+        """message: dict หรือ JSON string ที่ encode ไว้แล้ว (เช่นจาก _user_envelope)"""
+        conns = self.active_by_emp.get(emp)
+        if not conns:
+            return
+        text = message if isinstance(message, str) else _ws_encode(message)
+        # socket ที่ส่งไม่ผ่านจะถูก disconnect หลังส่งครบ
+        failed = await asyncio.gather(*(self._send(ws, text) for ws in conns))
+        for ws in failed:
+            if ws is not None:
                 self.disconnect(emp, ws)
 
+    @staticmethod
+    async def _send(ws: WebSocket, text: str) -> Optional[WebSocket]:
+        try:
+            await ws.send_text(text)
+            return None
+        except Exception:
+            return ws
+
+def _user_envelope(user_out: UserOut) -> str:
+    """{"type":"user","user":...} โดยให้ pydantic (core ภาษา Rust) serialize UserOut ตรง ๆ"""
+    return '{"type":"user","user":' + user_out.model_dump_json() + "}"
+
 manager = WSManager()
-_DIGITS_RE = re.compile(r"^\d{6,7}$")
 
 def _token_from_auth_header(header: Optional[str]) -> Optional[str]:
     if not header:
@@ -345,31 +542,73 @@ def _db_session():
             pass
 
 # ---------------- Auth ----------------
+# cache ผู้ใช้ฝั่ง login (employee_id -> UserOut) อายุสั้น ๆ กัน login ถี่ ๆ (retry/รีเฟรชแท็บ) ยิง DB ซ้ำ
+# update_me จะลบ entry ของตัวเองทิ้งทันทีหลัง commit
+_LOGIN_USER_TTL = float(os.getenv("LOGIN_USER_CACHE_TTL", "5"))
+_LOGIN_USER_CACHE_MAX = 1024
+_login_user_cache: Dict[str, Tuple[float, UserOut]] = {}
+_login_user_lock = threading.Lock()   # login รันใน threadpool หลาย thread พร้อมกัน
+
+def _login_user(db: Session, emp: str) -> Optional[UserOut]:
+    now = time.monotonic()
+    hit = _login_user_cache.get(emp)
+    if hit and now - hit[0] < _LOGIN_USER_TTL:
+        return hit[1]
+
+    user = db.query(User).filter(User.employee_id == emp).first()
+    if not user:
+        _login_user_cache.pop(emp, None)
+        return None
+
+    user_out = userout_for(user)
+    with _login_user_lock:
+        if len(_login_user_cache) >= _LOGIN_USER_CACHE_MAX:
+            for k, (ts, _) in list(_login_user_cache.items()):
+                if now - ts >= _LOGIN_USER_TTL:
+                    _login_user_cache.pop(k, None)
+            # ยังเต็ม (ไม่มีตัวไหนหมดอายุ) → ทิ้งตัวที่ใส่ไว้นานสุด ให้ MAX เป็นเพดานจริง
+            if len(_login_user_cache) >= _LOGIN_USER_CACHE_MAX:
+                _login_user_cache.pop(next(iter(_login_user_cache)), None)
+        # ลบก่อนใส่ → entry ไปอยู่ท้าย dict เสมอ ลำดับใน dict = ลำดับเวลาที่ใส่
+        _login_user_cache.pop(emp, None)
+        _login_user_cache[emp] = (now, user_out)
+    return user_out
+
+# login / update_me ใช้ SQLAlchemy แบบ sync → ห้ามรันบน event loop ตรง ๆ
+# login เป็น def ธรรมดา (FastAPI โยนเข้า threadpool ให้), update_me ใช้ run_in_threadpool
 @app.post("/auth/login", response_model=LoginOut)
-async def login(payload: LoginIn, db: Session = Depends(get_db)):
+def login(payload: LoginIn, db: Session = Depends(get_db)):
     raw = (payload.employee_id or "").strip().upper()
-    emp = re.sub(r"^EN", "", raw)
-    if not _DIGITS_RE.match(emp):
+    emp = match_employee_id(raw)
+    if emp is None:
         raise HTTPException(status_code=422, detail="Invalid Employee ID (6–7 digits)")
 
-    user = db.query(User).filter(User.employee_id == emp).first()
-    if not user:
+    user_out = _login_user(db, emp)
+    if not user_out:
         raise HTTPException(status_code=404, detail="Employee ID not found")
 
     # issue tokens (access + refresh)
-    access_token = create_access_token(sub=user.employee_id)
-    refresh_token = create_refresh_token(sub=user.employee_id)
+    access_token = create_access_token(sub=user_out.employee_id)
+    refresh_token = create_refresh_token(sub=user_out.employee_id)
 
-    needs_confirm = not bool(user.confirmed)
+    needs_confirm = not bool(user_out.confirmed)
     if not needs_confirm:
-        user.last_login_at = datetime.utcnow()
-        db.add(user); db.commit(); db.refresh(user)
+        # UPDATE ตรงคอลัมน์เดียว ไม่ต้อง refresh (SELECT ซ้ำ)
+        now = datetime.utcnow()
+        (db.query(User)
+           .filter(User.id == user_out.id)
+           .update({User.last_login_at: now}, synchronize_session=False))
+        db.commit()
+        user_out = user_out.model_copy(update={"last_login_at": now})
+        hit = _login_user_cache.get(emp)
+        if hit:
+            _login_user_cache[emp] = (hit[0], user_out)
 
     return LoginOut(
         access_token=access_token,
         refresh_token=refresh_token,
         token_type="bearer",
-        user=UserOut.model_validate(user),
+        user=user_out,
         needs_confirm=needs_confirm,
     )
 
@@ -388,27 +627,50 @@ async def logout(_: User = Depends(get_current_user)):
 
 @app.get("/auth/me", response_model=UserOut)
 def me(current: User = Depends(get_current_user)):
-    return UserOut.model_validate(current)
+    # JSON ของ UserOut ถูก cache ตามค่าแถว → ไม่ต้อง validate/serialize ซ้ำผ่าน response_model
+    return Response(content=userout_json_for(current), media_type="application/json")
+
+def _save_me(db: Session, current: User, data: UpdateMeIn) -> UserOut:
+    values = {
+        "name": data.name,
+        "email": data.email,
+        "confirmed": True,
+        "last_login_at": datetime.utcnow(),
+    }
+    (db.query(User)
+       .filter(User.id == current.id)
+       .update(values, synchronize_session=False))
+    db.commit()
+    for k, v in values.items():
+        set_committed_value(current, k, v)
+    _login_user_cache.pop(current.employee_id, None)
+    return userout_for(current)
 
 @app.put("/users/me", response_model=UserOut)
 async def update_me(
     data: UpdateMeIn,
+    background_tasks: BackgroundTasks,
     current: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    current.name = data.name
-    current.email = data.email
-    current.confirmed = True
-    current.last_login_at = datetime.utcnow()
-    db.add(current); db.commit(); db.refresh(current)
-
-    await manager.send_to_emp(
+    user_out = await run_in_threadpool(_save_me, db, current, data)
+    # push WS หลังส่ง response แล้ว → HTTP ไม่ต้องรอ socket ที่ช้า
+    background_tasks.add_task(
+        manager.send_to_emp,
         current.employee_id,
-        {"type": "user", "user": UserOut.model_validate(current)}
+        _user_envelope(user_out),
     )
-    return UserOut.model_validate(current)
+    return user_out
 
 # ---------------- WebSocket ----------------
+# ดึงเฉพาะคอลัมน์ที่ UserOut ใช้ (แถวเป็น Row ธรรมดา ไม่ต้องสร้าง ORM object / identity map)
+_USEROUT_COLUMNS = tuple(User.__table__.c[f] for f in UserOut.model_fields if f in User.__table__.c)
+
+def _ws_greeting(emp: str) -> Optional[str]:
+    with _db_session() as db:
+        row = db.execute(select(*_USEROUT_COLUMNS).where(User.employee_id == emp)).first()
+    return _user_envelope(userout_for(row)) if row else None
+
 @app.websocket("/ws")
 async def ws_endpoint(websocket: WebSocket, token: Optional[str] = Query(default=None)):
     await websocket.accept()
@@ -428,92 +690,130 @@ async def ws_endpoint(websocket: WebSocket, token: Optional[str] = Query(default
 
     await manager.connect(emp, websocket)
 
-    with _db_session() as db:
-        user = db.query(User).filter(User.employee_id == emp).first()
-        if user:
-            await manager.send_to_emp(
-                emp, {"type": "user", "user": UserOut.model_validate(user)}
-            )
+    # query แบบ sync → รันใน threadpool กัน event loop ค้างระหว่าง handshake
+    greeting = await run_in_threadpool(_ws_greeting, emp)
+    if greeting:
+        await manager.send_to_emp(emp, greeting)
 
+    # ข้อความจาก client ไม่ได้ใช้ (มีแค่ keepalive) → อ่าน ASGI message ดิบ ไม่ต้องดึง/ตรวจ text
+    # frame แบบ binary ก็แค่ข้ามไป ไม่ทำให้ loop หลุดเหมือน receive_text
     try:
-        while True:
-            _ = await websocket.receive_text()
-    except WebSocketDisconnect:
-        manager.disconnect(emp, websocket)
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
     except Exception:
+        pass
+    finally:
         manager.disconnect(emp, websocket)
 
 # ---------------- Demo notify ----------------
+# kwargs คงที่ (read-only กันถูกแก้ข้าม request; notify_user copy data ก่อนใช้อยู่แล้ว)
+_DEMO_OK_KW = MappingProxyType(dict(
+    type="print.completed", severity="success",
+    title="งานพิมพ์เสร็จ", message="ชิ้นงานของคุณพิมพ์เสร็จเรียบร้อย 🎉",
+    data=MappingProxyType({"job": "demo", "result": "success"}),
+))
+_DEMO_FAIL_KW = MappingProxyType(dict(
+    type="print.failed", severity="error",
+    title="พิมพ์ไม่สำเร็จ", message="เครื่องรายงานว่ามีข้อผิดพลาดระหว่างพิมพ์",
+    data=MappingProxyType({"job": "demo", "result": "failed"}),
+))
+
 @app.post("/_demo/notify/ok")
 async def demo_notify_ok(db: Session = Depends(get_db), current: User = Depends(get_current_user)):
-    await notify_user(
-        db, current.employee_id,
-        type="print.completed", severity="success",
-        title="งานพิมพ์เสร็จ", message="ชิ้นงานของคุณพิมพ์เสร็จเรียบร้อย 🎉",
-        data={"job": "demo", "result": "success"},
-    )
+    await notify_user(db, current.employee_id, **_DEMO_OK_KW)
     return {"ok": True}
 
 @app.post("/_demo/notify/fail")
 async def demo_notify_fail(db: Session = Depends(get_db), current: User = Depends(get_current_user)):
-    await notify_user(
-        db, current.employee_id,
-        type="print.failed", severity="error",
-        title="พิมพ์ไม่สำเร็จ", message="เครื่องรายงานว่ามีข้อผิดพลาดระหว่างพิมพ์",
-        data={"job": "demo", "result": "failed"},
-    )
+    await notify_user(db, current.employee_id, **_DEMO_FAIL_KW)
     return {"ok": True}
 
 # ---------------- Health ----------------
-def _health_payload():
-    return {
-        "ok": True,
-        "version": API_VERSION,
-        "origins": allow_origins,
-        "storage_backend": STORAGE_BACKEND,
-        "uploads_dir": UPLOADS_DIR_ABS,
-        "gpu_preview_enabled": GPU_PREVIEW_ENABLED,
-        "preview_backend": PREVIEW_BACKEND,
-        "preview_import_errors": preview_import_errors,
-        "ts": int(time.time()),
-    }
+# ค่าพวกนี้นิ่งหลัง import เสร็จ
+_HEALTH_BASE = MappingProxyType({
+    "ok": True,
+    "version": API_VERSION,
+    "origins": allow_origins,
+    "storage_backend": STORAGE_BACKEND,
+    "uploads_dir": UPLOADS_DIR_ABS,
+    "gpu_preview_enabled": GPU_PREVIEW_ENABLED,
+    "preview_backend": PREVIEW_BACKEND,
+    "preview_import_errors": preview_import_errors,
+    "db_pool": dict(DB_POOL_SETTINGS),
+})
+
+# encode ส่วนคงที่เป็น JSON ไว้ครั้งเดียว (ตัด "}" ท้ายออก) ต่อ request แค่ต่อ ts แล้วปิดวงเล็บ
+_HEALTH_PREFIX = (
+    json.dumps(dict(_HEALTH_BASE), separators=(",", ":"), ensure_ascii=False).encode()[:-1]
+    + b',"ts":'
+)
+
+def _health_response() -> Response:
+    return Response(
+        content=_HEALTH_PREFIX + str(int(time.time())).encode() + b"}",
+        media_type="application/json",
+    )
 
+# async def: งานแค่ต่อ bytes ไม่ต้อง hop ไป threadpool
 @app.get("/health")
-def health():
-    return _health_payload()
+async def health():
+    return _health_response()
 
 @app.get("/healthz")
-def healthz():
-    return _health_payload()
+async def healthz():
+    return _health_response()
 
-@app.get("/healthz/live")
-def healthz_live():
-    return {"ok": True, "ts": int(time.time())}
+class _LiveProbe:
+    """
+    /healthz/live แบบ ASGI ดิบ: ไม่ผ่าน FastAPI (dependency/encoder/response class)
+    เป็น instance (ไม่ใช่ function) เพื่อให้ Starlette Route มองเป็น ASGI app ตรง ๆ
+    """
+    _HEADERS = [(b"content-type", b"application/json")]
+
+    async def __call__(self, scope, receive, send):
+        body = b'{"ok":true,"ts":' + str(int(time.time())).encode() + b"}"
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": self._HEADERS + [(b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# probe ถูกยิงถี่ → วางไว้หัวตาราง route ให้ match ก่อนตัวอื่น
+_live_probe = _LiveProbe()
+app.router.routes.insert(0, Route("/healthz/live", _live_probe, methods=["GET"]))
+app.router.routes.insert(1, Route("/api/healthz/live", _live_probe, methods=["GET"]))
 
 @app.get("/healthz/ready")
-def healthz_ready():
-    return _health_payload()
+async def healthz_ready():
+    return _health_response()
 
 # สำเนา /api/* (คงความเข้ากันได้)
 app.add_api_route("/api/health", health, methods=["GET"], include_in_schema=False)
 app.add_api_route("/api/healthz", healthz, methods=["GET"], include_in_schema=False)
-app.add_api_route("/api/healthz/live", healthz_live, methods=["GET"], include_in_schema=False)
 app.add_api_route("/api/healthz/ready", healthz_ready, methods=["GET"], include_in_schema=False)
 
 # ---------------- Debug: list all routes ----------------
 from fastapi.routing import APIRoute
 
+# route ไม่เปลี่ยนหลังแอปพร้อม → encode JSON ครั้งแรกครั้งเดียวแล้วใช้ bytes เดิม
+_ROUTES_JSON: Optional[bytes] = None
+
 @app.get("/debug/routes")
 def debug_routes():
-    items = []
-    for r in app.router.routes:
-        items.append({
-            "type": type(r).__name__,
-            "path": getattr(r, "path", None),
-            "name": getattr(r, "name", None),
-            "methods": sorted(list(getattr(r, "methods", set()) or [])),
-        })
-    return items
+    global _ROUTES_JSON
+    if _ROUTES_JSON is None:
+        items = [
+            {
+                "type": type(r).__name__,
+                "path": getattr(r, "path", None),
+                "name": getattr(r, "name", None),
+                "methods": sorted(getattr(r, "methods", None) or ()),
+            }
+            for r in app.router.routes
+        ]
+        _ROUTES_JSON = json.dumps(items, ensure_ascii=False).encode("utf-8")
+    return Response(content=_ROUTES_JSON, media_type="application/json")
 
 # ---------------- Root ----------------
 @app.get("/")
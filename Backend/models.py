@@ -21,6 +21,7 @@ from sqlalchemy import (
     event,
     literal,
     func,          # ✅ เพิ่มบรรทัดนี้
+    text,
 )
 
 from sqlalchemy.orm import relationship, column_property
@@ -28,26 +29,68 @@ from sqlalchemy.orm import relationship, column_property
 from db import Base
 
 
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
 # ----------------------------- helpers -----------------------------
 
 def _json_loads(s: Optional[str]) -> Optional[Dict[str, Any]]:
     if not s:
         return None
     try:
-        return json.loads(s)
+        return orjson.loads(s) if orjson is not None else json.loads(s)
     except Exception:
         return None
 
 
+# encoder ตั้งค่าไว้ครั้งเดียว: json.dumps จะสร้าง JSONEncoder ใหม่ทุกครั้งที่ส่ง option ที่ไม่ใช่ค่า default
+_stdlib_json_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+_orjson_dumps = orjson.dumps if orjson is not None else None
+
+
 def _json_dumps(obj: Optional[Dict[str, Any]]) -> Optional[str]:
     if obj is None:
         return None
+    if _orjson_dumps is not None:
+        try:
+            return _orjson_dumps(obj).decode()
+        except Exception:
+            pass  # เช่น key ไม่ใช่ str → ให้ json ของ stdlib ลองต่อ
     try:
-        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+        return _stdlib_json_encode(obj)
     except Exception:
         return None
 
 
+class _JSONColumnAccessor:
+    """
+    อ่าน/เขียน dict ผ่านคอลัมน์ข้อความ JSON (เช่น template <-> template_json)
+    parse ครั้งเดียวต่อค่าในคอลัมน์: cache ผลไว้บน instance คู่กับสตริงดิบ
+    คอลัมน์ถูกเขียน/โหลดใหม่ → สตริงเปลี่ยน object → parse ใหม่เอง
+    """
+
+    def __init__(self, column: str):
+        self.column = column
+        self.cache_attr = f"_{column}_parsed"
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        raw = getattr(obj, self.column)
+        hit = obj.__dict__.get(self.cache_attr)
+        if hit is not None and hit[0] is raw:
+            return hit[1]
+        val = _json_loads(raw)
+        obj.__dict__[self.cache_attr] = (raw, val)
+        return val
+
+    def __set__(self, obj, val: Optional[Dict[str, Any]]) -> None:
+        setattr(obj, self.column, _json_dumps(val))
+
+
 # ============================ Users ============================
 
 class User(Base):
@@ -119,16 +162,27 @@ class Notification(Base):
 class NotificationTarget(Base):
     """การกระจายแจ้งเตือนไปยังผู้รับ (ต่อ 1 ผู้รับ = 1 แถว)"""
     __tablename__ = "notification_targets"
-    __table_args__ = (Index("ix_notification_targets_emp", "employee_id"),)
+    # PK ผสม (employee_id, notification_id) + WITHOUT ROWID บน SQLite:
+    # ไม่มี rowid table ซ้อนกับ index ของ employee_id อีกชั้น → "แจ้งเตือนของพนักงาน X"
+    # เป็น range scan บน PK ตรง ๆ (ผู้รับ 1 คนมีได้แถวเดียวต่อ notification อยู่แล้ว)
+    __table_args__ = (
+        # ยังไม่อ่านของพนักงาน X (mark-read / mark-all-read): partial index เก็บเฉพาะแถว read_at IS NULL
+        # → เล็กมากเมื่อเทียบกับทั้งตาราง และเรียงตาม notification_id อยู่แล้ว
+        Index(
+            "ix_notif_targets_emp_unread", "employee_id", "notification_id",
+            sqlite_where=text("read_at IS NULL"),
+            postgresql_where=text("read_at IS NULL"),
+        ),
+        {"sqlite_with_rowid": False},
+    )
 
-    id = Column(Integer, primary_key=True)
+    employee_id = Column(String, primary_key=True)   # อิง user ด้วย employee_id
     notification_id = Column(
         Integer,
         ForeignKey("notifications.id", ondelete="CASCADE"),
-        index=True,
-        nullable=False,
+        primary_key=True,
+        index=True,   # ใช้ตอน join/ลบตาม notification
     )
-    employee_id = Column(String, index=True, nullable=False)   # อิง user ด้วย employee_id
     read_at = Column(DateTime, nullable=True)
 
     notification = relationship("Notification", back_populates="targets")
@@ -181,10 +235,21 @@ class PrintJob(Base):
     """
     __tablename__ = "print_jobs"
     __table_args__ = (
-        Index("ix_print_jobs_printer_status", "printer_id", "status"),
+        # งานที่กำลังพิมพ์ของเครื่อง: printer_id = ? AND status IN (...) ORDER BY started_at DESC, id DESC LIMIT 1
+        # ใส่ started_at/id ต่อท้าย → แต่ละ status อ่านจากท้าย range ได้เลย ไม่ต้อง sort ทั้งชุด
+        # (prefix printer_id,status ใช้แทน ix_print_jobs_printer_status เดิมได้ครบ)
+        Index(
+            "ix_print_jobs_printer_status_started",
+            "printer_id", "status", text("started_at DESC"), text("id DESC"),
+        ),
         Index("ix_print_jobs_uploaded", "printer_id", "uploaded_at"),
+        # ประวัติของฉัน: WHERE employee_id=? ORDER BY uploaded_at DESC, id DESC
+        # SQLite ไล่ index นี้ย้อนหลังได้เลย และ id (rowid) ต่อท้ายทุก index อยู่แล้ว → ไม่มีขั้น sort
+        # (ไม่ต้องมี index แบบ DESC แยก / covering ไม่ได้อยู่ดีเพราะ query ดึงทั้งแถว)
         Index("ix_print_jobs_owner_uploaded", "employee_id", "uploaded_at"),
         Index("ix_print_jobs_owner_status", "employee_id", "status"),
+        # "ไฟล์นี้ยังมีงานค้าง/มีประวัติไหม" (ลบไฟล์ใน storage, กันสั่งพิมพ์ซ้ำ) กรองด้วย gcode_path + status
+        Index("ix_print_jobs_gcode_status", "gcode_path", "status"),
         CheckConstraint(
             "status in ('queued','processing','paused','canceled','failed','completed')",
             name="ck_print_jobs_status",
@@ -269,29 +334,9 @@ class PrintJob(Base):
         )
 
     # ---------- convenience JSON accessors ----------
-    @property
-    def template(self) -> Optional[Dict[str, Any]]:
-        return _json_loads(self.template_json)
-
-    @template.setter
-    def template(self, val: Optional[Dict[str, Any]]) -> None:
-        self.template_json = _json_dumps(val)
-
-    @property
-    def stats(self) -> Optional[Dict[str, Any]]:
-        return _json_loads(self.stats_json)
-
-    @stats.setter
-    def stats(self, val: Optional[Dict[str, Any]]) -> None:
-        self.stats_json = _json_dumps(val)
-
-    @property
-    def file(self) -> Optional[Dict[str, Any]]:
-        return _json_loads(self.file_json)
-
-    @file.setter
-    def file(self, val: Optional[Dict[str, Any]]) -> None:
-        self.file_json = _json_dumps(val)
+    template = _JSONColumnAccessor("template_json")
+    stats = _JSONColumnAccessor("stats_json")
+    file = _JSONColumnAccessor("file_json")
 
     def __repr__(self) -> str:
         return f"<PrintJob id={self.id} emp={self.employee_id} status={self.status} name={self.name!r}>"
@@ -311,11 +356,17 @@ class StorageFile(Base):
     __tablename__ = "storage_files"
     __table_args__ = (
         Index("ix_storage_files_emp_uploaded", "employee_id", "uploaded_at"),
-        Index("ix_storage_files_key", "object_key"),
-        # ป้องกันสร้างซ้ำ object_key
+        # ป้องกันสร้างซ้ำ object_key (unique constraint มี index ของมันเองอยู่แล้ว
+        # → ไม่ต้องมี ix บน object_key แยกอีกตัวให้ต้องอัปเดตทุก INSERT)
         UniqueConstraint("object_key", name="uq_storage_files_object_key"),
-        # กันชื่อซ้ำต่อผู้ใช้ (ไม่แคร์ตัวพิมพ์)
-        UniqueConstraint("employee_id", "name_low", name="uq_storage_files_emp_name_low"),
+        # กันชื่อซ้ำต่อผู้ใช้ (ไม่แคร์ตัวพิมพ์) — partial index: ไม่เก็บแถว name_low ว่าง
+        # (แถวเก่าที่ยังไม่มีชื่อ) → B-tree เล็กลง ตรวจ uniqueness ตอน INSERT เร็วขึ้น
+        Index(
+            "uq_storage_files_emp_name_low", "employee_id", "name_low",
+            unique=True,
+            sqlite_where=text("name_low != ''"),
+            postgresql_where=text("name_low != ''"),
+        ),
         Index("ix_storage_files_name_low", "name_low"),
     )
 
@@ -326,8 +377,9 @@ class StorageFile(Base):
     filename = Column(String(255), nullable=False)
 
     # ใหม่: ชื่อสำหรับโชว์/ตรวจซ้ำ (ถ้าไม่ได้ระบุ จะ fallback จาก filename อัตโนมัติ)
-    name = Column(String(255), nullable=False, default="")      # e.g. MyPart_V3.gcode
-    name_low = Column(String(255), nullable=False, default="")  # e.g. mypart_v3.gcode
+    # ค่าตอน INSERT คำนวณใน default ของคอลัมน์เอง (ไม่ผ่าน event ทีละแถว)
+    name = Column(String(255), nullable=False, default=lambda ctx: _sf_name_from_params(ctx))          # e.g. MyPart_V3.gcode
+    name_low = Column(String(255), nullable=False, default=lambda ctx: _sf_name_from_params(ctx).lower())  # e.g. mypart_v3.gcode
 
     object_key = Column(String(512), nullable=False)            # key ใน S3 เช่น storage/2025/09/02/uuid.gcode
     content_type = Column(String(128), nullable=True)
@@ -347,15 +399,15 @@ class StorageFile(Base):
         return f"<StorageFile id={self.id} key={self.object_key!r} emp={self.employee_id} name={self.name!r}>"
 
 
-# ---------- sync hooks: ทำให้ name/name_low สอดคล้อง และไม่ทำของเก่าพัง ----------
+# ---------- sync: ทำให้ name/name_low สอดคล้อง และไม่ทำของเก่าพัง ----------
 
-@event.listens_for(StorageFile, "before_insert")
-def _sf_before_insert(mapper, connection, target: StorageFile):
-    # ถ้า caller ยังไม่ได้ตั้ง name ให้ใช้ filename เป็นค่าเริ่มต้น
-    if not (target.name and target.name.strip()):
-        target.name = (target.filename or "").strip()
-    target.name_low = (target.name or "").strip().lower()
+def _sf_name_from_params(ctx) -> str:
+    # INSERT: ถ้า caller ไม่ได้ตั้ง name ให้ใช้ filename เป็นค่าเริ่มต้น
+    p = ctx.get_current_parameters()
+    return (p.get("name") or "").strip() or (p.get("filename") or "").strip()
 
+# UPDATE ยังต้องใช้ event: onupdate ของคอลัมน์เห็นแค่คอลัมน์ที่อยู่ใน SET
+# (แก้ size อย่างเดียวจะคำนวณ name_low จากค่าว่าง) — event นี้ยิงเฉพาะแถวที่ dirty อยู่แล้ว
 @event.listens_for(StorageFile, "before_update")
 def _sf_before_update(mapper, connection, target: StorageFile):
     # ถ้ามีการแก้ name หรือ filename ให้คงความสอดคล้อง
@@ -1,14 +1,16 @@
 # backend/notifications.py
 from __future__ import annotations
 
-import os, re, asyncio, json, logging, inspect, time, threading
+import os, re, asyncio, json, logging, inspect, time, threading, functools, heapq
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Set, Optional, Iterable, List, Tuple, Literal, Union, Any
-from collections import deque
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import httpx
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, Header, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import StreamingResponse, HTMLResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
@@ -16,10 +18,18 @@ from db import get_db, SessionLocal
 from models import Notification, NotificationTarget, User, PrintJob
 from schemas import NotificationOut, NotificationCreate, NotificationMarkRead
 from auth import get_user_from_header_or_query  # covers Header / ?token=
+from http_pool import SharedAsyncClient
 from emailer import send_notification_email
 from teams_flow_webhook import notify_dm
 from models import LatencyLog
 
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
 # =============================================================================
 # Logger
 # =============================================================================
@@ -135,13 +145,19 @@ def _fmt_bkk(dt: Optional[datetime] = None) -> str:
     d = (dt or datetime.utcnow()).astimezone(_TZ_BKK)
     return d.strftime("%d %b %Y %H:%M")
 
+# loopback ไป backend ตัวเอง: ใช้ client keep-alive ร่วมกัน ไม่เปิด TCP ใหม่ทุกครั้ง
+_INTERNAL_HTTP = SharedAsyncClient(
+    timeout=httpx.Timeout(10.0, connect=2.0),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+)
+
 async def _call_internal(path: str, *, reason: str | None = None) -> dict:
     url = f"{BACKEND_INTERNAL_BASE}{path}"
     headers = {"X-Admin-Token": ADMIN_TOKEN}
     if reason:
         headers["X-Reason"] = reason
     try:
-        async with httpx.AsyncClient(timeout=10) as c:
+        async with _INTERNAL_HTTP.client() as c:
             r = await c.post(url, headers=headers)
             r.raise_for_status()
             return r.json()
@@ -150,10 +166,10 @@ async def _call_internal(path: str, *, reason: str | None = None) -> dict:
         return {"ok": False, "error": "internal_call_failed"}
 
 # Detector policy
-ALLOWED_DETECT_CLASSES = {
+ALLOWED_DETECT_CLASSES = frozenset(
     s.strip().lower() for s in (_clean_env(os.getenv("ALLOWED_DETECT_CLASSES")) or "cracks,layer_shift,spaghetti,stringing").split(",")
     if s.strip()
-}
+)
 def _as_float(s: Optional[str], default: float) -> float:
     try:
         return float(_clean_env(s) or default)
@@ -166,8 +182,8 @@ BED_EMPTY_BROADCAST = _as_bool(os.getenv("BED_EMPTY_BROADCAST"), False)
 
 # Auto-pause policy
 AUTO_PAUSE = _as_bool(os.getenv("AUTO_PAUSE_ON_DETECT"), True)
-PAUSE_ON_EVENTS  = {s.strip().lower() for s in (_clean_env(os.getenv("PAUSE_ON_EVENTS")) or "issue_started,issue_update").split(",") if s.strip()}
-PAUSE_ON_CLASSES = {s.strip().lower() for s in (_clean_env(os.getenv("PAUSE_ON_CLASSES")) or "cracks,layer_shift,spaghetti,stringing").split(",") if s.strip()}
+PAUSE_ON_EVENTS  = frozenset(s.strip().lower() for s in (_clean_env(os.getenv("PAUSE_ON_EVENTS")) or "issue_started,issue_update").split(",") if s.strip())
+PAUSE_ON_CLASSES = frozenset(s.strip().lower() for s in (_clean_env(os.getenv("PAUSE_ON_CLASSES")) or "cracks,layer_shift,spaghetti,stringing").split(",") if s.strip())
 PAUSE_MIN_CONF   = _as_float(os.getenv("PAUSE_MIN_CONFIDENCE"), 0.70)
 
 # Debounce confirm
@@ -296,11 +312,15 @@ async def _start_bed_timeout_watcher(printer_id: str, finished_at: datetime, own
     pid = (printer_id or "-").strip().lower()
     try:
         deadline = finished_at + timedelta(seconds=WATCH_BED_EMPTY_TIMEOUT_SEC)
-        while datetime.utcnow() < deadline:
+        while True:
+            remaining = (deadline - datetime.utcnow()).total_seconds()
+            if remaining <= 0:
+                break
             ts = _BED_EMPTY_TS.get(pid)
             if ts and ts > finished_at:
                 return
-            await asyncio.sleep(2.0)
+            # รอบสุดท้ายนอนแค่เท่าที่เหลือ → แจ้งตรง deadline ไม่เลยไปอีกถึง 2 วิ
+            await asyncio.sleep(min(2.0, remaining))
 
         # NOTE: ใช้เว็บ/SSE เท่านั้น ไม่ DM
         if owner_emp:
@@ -326,6 +346,54 @@ async def _start_bed_timeout_watcher(printer_id: str, finished_at: datetime, own
 # =============================================================================
 # SSE broker (per-employee)
 # =============================================================================
+def _sse_data(payload: Union[dict, str]) -> bytes:
+    """เฟรม SSE 'data: ...' เป็น bytes พร้อมส่ง — str = JSON ที่ encode มาแล้ว (ผู้ส่งหลายทางจะ encode ครั้งเดียว)
+    คืน bytes → ทุกคิวถือ object เดียวกัน และ StreamingResponse ไม่ต้อง encode UTF-8 ซ้ำต่อ subscriber"""
+    if isinstance(payload, str):
+        body = payload.encode()
+    elif orjson is not None:
+        try: body = orjson.dumps(payload)
+        except Exception: body = _json(payload).encode()
+    else:
+        body = _json(payload).encode()
+    return b"data: " + body + b"\n\n"
+
+_SSE_KEEPALIVE = b":keepalive\n\n"
+
+async def _sse_pump(request: Request, q: asyncio.Queue, idle: float = 25.0):
+    """ส่งเฟรมจากคิวของ subscriber (bytes ที่ encode แล้ว) + keepalive เมื่อเงียบเกิน idle วินาที
+    ใช้ timer (call_later) ใส่ sentinel ลงคิวแทน wait_for → ไม่ต้องสร้าง Task/timeout ทุกข้อความ"""
+    loop = asyncio.get_running_loop()
+    def _tick():
+        try: q.put_nowait(_SSE_KEEPALIVE)
+        except asyncio.QueueFull: pass   # คิวเต็ม = ยังมีของให้ส่งอยู่แล้ว
+    timer = loop.call_later(idle, _tick)
+    try:
+        while True:
+            frame = await q.get()
+            timer.cancel()
+            if frame is _SSE_KEEPALIVE and await request.is_disconnected():
+                break
+            yield frame
+            timer = loop.call_later(idle, _tick)
+    finally:
+        timer.cancel()
+
+def _offer(q: asyncio.Queue, payload: Union[dict, str, bytes]) -> bool:
+    """ใส่ payload แบบไม่รอ: คิวเต็ม (client อ่านช้า) → ทิ้งตัวเก่าสุดแล้วใส่ใหม่
+    publisher ไม่ถูก subscriber ตัวไหนถ่วง; คืน False ถ้าใส่ไม่ได้จริง ๆ (ให้ unsubscribe)"""
+    try:
+        q.put_nowait(payload); return True
+    except asyncio.QueueFull:
+        try: _ = q.get_nowait()
+        except Exception: pass
+        try:
+            q.put_nowait(payload); return True
+        except Exception:
+            return False
+    except Exception:
+        return False
+
 class NotificationBroker:
     def __init__(self):
         self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
@@ -343,24 +411,51 @@ class NotificationBroker:
         qs.discard(q)
         if not qs: self.subscribers.pop(emp, None)
 
-    async def publish(self, emp: str, payload: dict):
+    async def publish(self, emp: str, payload: Union[dict, str]):
         qs = list(self.subscribers.get(emp, set()))
         if not qs: return
+        frame = _sse_data(payload)   # encode ครั้งเดียว ทุกคิวได้ str ตัวเดียวกัน
         for q in qs:
-            try:
-                q.put_nowait(payload)
-            except asyncio.QueueFull:
-                try: _ = q.get_nowait()
-                except Exception: pass
-                try: q.put_nowait(payload)
-                except Exception: self.unsubscribe(emp, q)
+            if not _offer(q, frame): self.unsubscribe(emp, q)
 
 broker = NotificationBroker()
 
 # =============================================================================
 # Helpers
 # =============================================================================
+class _TTLMap:
+    """key → เวลาที่เห็นล่าสุด (time.monotonic) สำหรับกันยิงซ้ำ
+    - หมดอายุเมื่อเกิน ttl (ตรวจตอนถาม ไม่ต้องมีรอบกวาด)
+    - เกิน maxsize ทิ้งตัวที่ใส่เก่าสุด (ลำดับใน OrderedDict = ลำดับเวลา)"""
+    __slots__ = ("ttl", "maxsize", "_d")
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = float(ttl); self.maxsize = int(maxsize)
+        self._d: "OrderedDict[Any, float]" = OrderedDict()
+
+    def seen(self, k) -> bool:
+        ts = self._d.get(k)
+        if ts is None: return False
+        if time.monotonic() - ts < self.ttl: return True
+        self._d.pop(k, None); return False
+
+    def mark(self, k) -> None:
+        self._d[k] = time.monotonic(); self._d.move_to_end(k)
+        if len(self._d) > self.maxsize:
+            self._d.popitem(last=False)
+
+    def check_and_mark(self, k) -> bool:
+        """True = เพิ่งเห็นไปภายใน ttl (ให้ข้าม); ไม่งั้นจดว่าเห็นแล้วคืน False"""
+        if self.seen(k): return True
+        self.mark(k); return False
+
 def _json(data: dict) -> str:
+    # ใช้กับทุกข้อความ SSE/WS: orjson (C, format float ของ boxes เร็วกว่ามาก) ถ้ามี
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode()
+        except Exception:
+            pass  # เช่น key ไม่ใช่ str → ให้ json ของ stdlib ลองต่อ
     try:
         return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
     except Exception:
@@ -391,24 +486,34 @@ def _to_out(n: Notification, read_at: Optional[datetime]) -> NotificationOut:
         severity=sev,
         title=n.title,
         message=n.message,
-        data=json.loads(n.data_json) if n.data_json else None,
+        data=_json_loads(n.data_json) if n.data_json else None,
         created_at=n.created_at,
         read=bool(read_at),
     )
 
-def _rows_to_out(rows: Iterable[Tuple[Notification, Optional[datetime]]]) -> List[NotificationOut]:
-    return [_to_out(n, read_at) for (n, read_at) in rows]
+# รายการแจ้งเตือน: select เฉพาะคอลัมน์ที่ NotificationOut ใช้ (ได้ Row ธรรมดา ไม่ต้องสร้าง ORM object
+# / identity map ต่อแถว) — Row มี attribute ชื่อเดียวกับ Notification จึงส่งเข้า _to_out ได้ตรง ๆ
+_NOTIF_LIST_COLS = (
+    Notification.id, Notification.ntype, Notification.severity, Notification.title,
+    Notification.message, Notification.data_json, Notification.created_at, NotificationTarget.read_at,
+)
+
+def _rows_to_out(rows: Iterable[Any]) -> List[NotificationOut]:
+    return [_to_out(r, r.read_at) for r in rows]
+
+_GCODE_EXT_RE = re.compile(r"\.(gcode|gco|gc)$", re.I)
 
 def _preview_key_from_gcode(gk: Optional[str]) -> Optional[str]:
     if not gk: return None
     gk = str(gk).strip()
     if not gk: return None
-    if not re.search(r"\.(gcode|gco|gc)$", gk, flags=re.I): return None
-    return re.sub(r"\.(gcode|gco|gc)$", ".preview.png", gk, flags=re.I)
+    # subn ครั้งเดียวแทน search แล้ว sub ซ้ำ (n == 0 = ไม่ใช่ไฟล์ gcode)
+    out, n = _GCODE_EXT_RE.subn(".preview.png", gk, count=1)
+    return out if n else None
 
 def _valid_url(u: Optional[str]) -> bool:
     try:
-        return bool(u and re.match(r"^https?://", u.strip(), flags=re.I))
+        return bool(u) and u.strip()[:8].lower().startswith(("http://", "https://"))
     except Exception:
         return False
 
@@ -500,6 +605,36 @@ async def emit_canonical_event(db: Session, employee_id: str, ev: dict) -> None:
 # =============================================================================
 # Channels: Email / Teams DM / HoloLens / SSE
 # =============================================================================
+# DM/email เป็นงาน blocking (HTTP/SMTP + retry ด้วย time.sleep + เปิด DB session)
+# → แยกไปรันบน pool ของตัวเองขนาดคงที่ ไม่แย่ง default executor ของ loop
+# และไม่เปิด session/connection พร้อมกันเกินจำนวน worker ตอนแจ้งเตือนถี่ ๆ
+NOTIFY_CHANNEL_WORKERS = max(1, int(_as_float(os.getenv("NOTIFY_CHANNEL_WORKERS"), 4)))
+NOTIFY_CHANNEL_MAX_PENDING = max(1, int(_as_float(os.getenv("NOTIFY_CHANNEL_MAX_PENDING"), 10000)))
+_CHANNEL_POOL = ThreadPoolExecutor(max_workers=NOTIFY_CHANNEL_WORKERS, thread_name_prefix="notify-ch")
+_channel_pending = 0
+_channel_lock = threading.Lock()
+
+def _channel_submit(fn, *args) -> None:
+    """ส่งงาน DM/email เข้าคิว; คิวเต็ม = ทิ้ง (แจ้งเตือนยังอยู่ใน DB/SSE ครบ)"""
+    global _channel_pending
+    with _channel_lock:
+        if _channel_pending >= NOTIFY_CHANNEL_MAX_PENDING:
+            log.warning("[NOTIFY] channel queue full; drop %s", getattr(fn, "__name__", fn))
+            return
+        _channel_pending += 1
+
+    def _run():
+        global _channel_pending
+        try:
+            fn(*args)
+        except Exception:
+            log.exception("[NOTIFY] channel worker error")
+        finally:
+            with _channel_lock:
+                _channel_pending -= 1
+
+    _CHANNEL_POOL.submit(_run)
+
 def _send_email_bg(emp_id: str, ntype: str, title: str, message: str | None, data: dict | None):
     if not EMAIL_ENABLED:
         return
@@ -526,20 +661,13 @@ def _dm_env_ready() -> bool:
     return True
 
 _DM_SUPPRESS_TTL_SEC = int(_as_float(os.getenv("DM_SUPPRESS_TTL_SEC"), 20))
-_recent_dm: Dict[Tuple[str,str], datetime] = {}
+_recent_dm = _TTLMap(_DM_SUPPRESS_TTL_SEC, 500)
+_recent_dm_lock = threading.Lock()   # ถูกเรียกจาก worker ของ DM หลายเธรดพร้อมกัน
 
 def _dm_should_skip_dup(emp_id: str, status: str) -> bool:
-    now = datetime.utcnow()
     k = (emp_id.strip(), (status or "").strip().lower())
-    ts = _recent_dm.get(k)
-    if ts and (now - ts).total_seconds() < _DM_SUPPRESS_TTL_SEC:
-        return True
-    _recent_dm[k] = now
-    if len(_recent_dm) > 500:
-        cutoff = now - timedelta(seconds=_DM_SUPPRESS_TTL_SEC*2)
-        for kk, vv in list(_recent_dm.items()):
-            if vv < cutoff: _recent_dm.pop(kk, None)
-    return False
+    with _recent_dm_lock:
+        return _recent_dm.check_and_mark(k)
 
 # ==== DM gate (policy check) =================================================
 def _should_send_dm_by_policy(ntype: str, status: str | None, data: dict | None) -> tuple[bool, str]:
@@ -701,6 +829,13 @@ async def _mirror_to_hololens_if_possible(printer_id: Optional[str], *, severity
 # =============================================================================
 # notify_user — single place: DB/SSE + DM + Email + HoloLens
 # =============================================================================
+def _persist_notification(db: Session, n: Notification, emps: List[str]) -> None:
+    # flush เอา n.id (created_at เป็น default ฝั่ง Python มีค่าแล้ว ไม่ต้อง refresh)
+    # แล้ว insert target ทั้งหมดเป็น batch เดียว + commit ครั้งเดียว ไม่ว่าผู้รับกี่คน
+    db.add(n); db.flush()
+    db.bulk_insert_mappings(NotificationTarget, [{"notification_id": n.id, "employee_id": e} for e in emps])
+    db.commit()
+
 async def notify_user(
     db: Session,
     employee_id: str,
@@ -712,7 +847,30 @@ async def notify_user(
     data: dict | None = None,
     payload: dict | None = None,
     **extra: Any,
-) -> Notification:
+) -> Optional[Notification]:
+    return await notify_many(
+        db, [employee_id], type=type, title=title, message=message,
+        severity=severity, data=data, payload=payload, **extra,
+    )
+
+async def notify_many(
+    db: Session,
+    employee_ids: List[str],
+    *,
+    type: str | None = None,
+    title: str | None = None,
+    message: str | None = None,
+    severity: str = "info",
+    data: dict | None = None,
+    payload: dict | None = None,
+    **extra: Any,
+) -> Optional[Notification]:
+    """แจ้งเตือนเดียวถึงหลายผู้รับ: Notification 1 แถว + target ต่อผู้รับ ใน commit เดียว"""
+    # ตัดค่าว่าง/ซ้ำ (PK ของ target คือ employee_id+notification_id) คงลำดับเดิม
+    emps = list(dict.fromkeys(e for e in (employee_ids or [])[:1000] if e))
+    if not emps:
+        return None
+
     # merge from payload if provided
     if payload and not type and not title:
         try:
@@ -745,19 +903,21 @@ async def notify_user(
         severity=sev_final,
         data_json=json.dumps(d_safe, ensure_ascii=False)
     )
-    db.add(n); db.commit(); db.refresh(n)
-    db.add(NotificationTarget(notification_id=n.id, employee_id=employee_id)); db.commit()
+    # commit (fsync) เป็น I/O แบบ blocking → ทำใน threadpool ไม่ให้ loop ที่ส่ง SSE/WS อยู่ค้าง
+    await run_in_threadpool(_persist_notification, db, n, emps)
 
+    # d_safe คือ dict ที่เพิ่ง serialize ลง data_json → ใช้ตรง ๆ ไม่ต้อง json.loads กลับ
+    # (SSE/DM/email อ่านอย่างเดียว — DM คัดลอกก่อนแก้เอง)
+    payload_for_channels = d_safe
     event = {
         "id": n.id, "type": n.ntype, "severity": n.severity, "title": n.title, "message": n.message,
-        "data": json.loads(n.data_json) if n.data_json else None, "created_at": n.created_at.isoformat(), "read": False
+        "data": payload_for_channels, "created_at": n.created_at.isoformat(), "read": False
     }
-    await broker.publish(employee_id, event)
-
-    payload_for_channels = json.loads(n.data_json) if n.data_json else None
-
-    _spawn(_send_dm_bg,   employee_id, n.ntype, n.title or "", n.message, payload_for_channels)
-    _spawn(_send_email_bg, employee_id, n.ntype, n.title or "", n.message, payload_for_channels)
+    event_json = _json(event)   # ผู้รับหลายคน encode ครั้งเดียว
+    for emp in emps:
+        await broker.publish(emp, event_json)
+        _channel_submit(_send_dm_bg,   emp, n.ntype, n.title or "", n.message, payload_for_channels)
+        _channel_submit(_send_email_bg, emp, n.ntype, n.title or "", n.message, payload_for_channels)
 
     try:
         d = payload_for_channels or {}
@@ -768,10 +928,6 @@ async def notify_user(
 
     return n
 
-async def notify_many(db: Session, employee_ids: List[str], **kwargs):
-    for emp in employee_ids[:1000]:
-        await notify_user(db, emp, **kwargs)
-
 # =============================================================================
 # Legacy/canonical bridge for job events
 # =============================================================================
@@ -863,23 +1019,18 @@ class UnityAlertHub:
             star.discard(ws)
             if not star: self.rooms.pop("*", None)
 
-    async def broadcast(self, printer_id: str, payload: dict):
-        targets = set()
-        if printer_id in self.rooms: targets |= self.rooms[printer_id]
-        if "*" in self.rooms: targets |= self.rooms["*"]
-
-        dead: list[WebSocket] = []
-        data = json.dumps(payload, ensure_ascii=False)
-        for ws in list(targets):
-            try:
-                await ws.send_text(data)
-            except Exception:
-                dead.append(ws)
-
-        if dead:
-            for key, room in list(self.rooms.items()):
-                for ws in dead:
-                    if ws in room: room.discard(ws)
+    async def broadcast(self, printer_id: str, payload: Union[dict, str]):
+        # จำ (room, ws) ไว้ตอนส่ง → ลบ socket ที่ตายจาก room ของมันตรง ๆ ไม่ต้องไล่ทุก room
+        pairs = [(key, ws) for key in {printer_id, "*"} for ws in self.rooms.get(key, ())]
+        if not pairs: return
+        data = payload if isinstance(payload, str) else _json(payload)
+        # ส่งพร้อมกัน: client ช้าตัวเดียวไม่ถ่วงตัวอื่น
+        results = await asyncio.gather(*(ws.send_text(data) for _, ws in pairs), return_exceptions=True)
+        for (key, ws), res in zip(pairs, results):
+            if isinstance(res, Exception):
+                room = self.rooms.get(key)
+                if room is None: continue
+                room.discard(ws)
                 if not room: self.rooms.pop(key, None)
 
 unity_ws = UnityAlertHub()
@@ -916,25 +1067,26 @@ class PrinterSSEBroker:
         qs.discard(q)
         if not qs: self.subscribers.pop(pid, None)
 
-    async def publish(self, printer_id: str, payload: dict):
+    async def publish(self, printer_id: str, payload: Union[dict, str]):
         targets = []
         for key in ((printer_id or "").strip().lower(), "*"):
             for q in list(self.subscribers.get(key, set())):
                 targets.append((key, q))
-        dead = []
+        if not targets: return
+        frame = _sse_data(payload)
         for key, q in targets:
-            try:
-                await q.put(payload)
-            except Exception:
-                dead.append((key, q))
-        for key, q in dead:
-            self.unsubscribe(key, q)
+            if not _offer(q, frame): self.unsubscribe(key, q)
 
 printer_sse = PrinterSSEBroker()
 
 async def _emit_printer_event(printer_id: str, payload: dict):
-    _spawn(printer_sse.publish, printer_id, payload)
-    await unity_ws.broadcast(printer_id, payload)
+    data = _json(payload)   # SSE และ WS ใช้ JSON เดียวกัน
+    _spawn(printer_sse.publish, printer_id, data)
+    await unity_ws.broadcast(printer_id, data)
+
+def _broadcast_defect(base: dict, **over) -> dict:
+    """payload ของ event ตรวจจับ = ฟิลด์ร่วม (base) + ฟิลด์เฉพาะกรณี"""
+    return {**base, **over}
 
 @router.get("/printers/stream")
 async def printers_stream(
@@ -948,13 +1100,8 @@ async def printers_stream(
     async def gen():
         yield ":connected\n\n"
         try:
-            while True:
-                try:
-                    item = await asyncio.wait_for(q.get(), timeout=25)
-                    yield f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
-                except asyncio.TimeoutError:
-                    if await request.is_disconnected(): break
-                    yield ":keepalive\n\n"
+            async for frame in _sse_pump(request, q):
+                yield frame
         finally:
             printer_sse.unsubscribe(pid, q)
 
@@ -969,35 +1116,36 @@ async def printers_stream(
 # =============================================================================
 RECENT_DETECT_MAX = int(_as_float(os.getenv("RECENT_DETECT_MAX"), 500))
 RECENT_DETECTS = deque(maxlen=max(50, RECENT_DETECT_MAX))
+# index รายเครื่อง (ชี้ dict ตัวเดียวกับ RECENT_DETECTS ไม่ได้ copy): /detects?printer_id=...
+# ไล่เฉพาะของเครื่องนั้น ไม่ต้องกรองทั้ง buffer — ตัดตามตอน RECENT_DETECTS ล้น ให้ข้อมูลชุดเดียวกันเสมอ
+_DETECTS_BY_PRINTER: Dict[str, deque] = {}
 
-class DetectRecord(BaseModel):
-    ts: float
-    event: str
-    printer_id: str | None = None
-    detected_class: str | None = None
-    confidence: float | None = None
-    image_url: str | None = None
-    video_url: str | None = None
-    boxes: list[list[float]] | None = None
-    image_w: int | None = None
-    image_h: int | None = None
-    source: str | None = None
+# เก็บเป็น dict ธรรมดา: เรียกทุกเฟรมที่ detector ส่งมา และปลายทางมีแค่ /detects (ส่งออกเป็น JSON)
+# → ไม่ต้องสร้าง/validate pydantic model ต่อ event
+_DETECT_KEYS = ("printer_id", "detected_class", "image_url", "video_url", "boxes", "image_w", "image_h", "source")
 
 def _push_detect(payload: dict):
     try:
-        RECENT_DETECTS.append(DetectRecord(
-            ts=float(payload.get("ts") or 0),
-            event=str(payload.get("event") or ""),
-            printer_id=payload.get("printer_id"),
-            detected_class=payload.get("detected_class"),
-            confidence=payload.get("confidence"),
-            image_url=payload.get("image_url"),
-            video_url=payload.get("video_url"),
-            boxes=payload.get("boxes"),
-            image_w=payload.get("image_w"),
-            image_h=payload.get("image_h"),
-            source=payload.get("source"),
-        ))
+        conf = payload.get("confidence")
+        rec = {
+            "ts": float(payload.get("ts") or 0),
+            "event": str(payload.get("event") or ""),
+            "confidence": float(conf) if conf is not None else None,
+        }
+        for k in _DETECT_KEYS: rec[k] = payload.get(k)
+        if len(RECENT_DETECTS) == RECENT_DETECTS.maxlen:
+            # ตัวที่จะหลุดจาก ring = ตัวเก่าสุดของเครื่องนั้นเสมอ (FIFO ต่อเครื่อง)
+            old_pid = RECENT_DETECTS[0]["printer_id"] or ""
+            old_dq = _DETECTS_BY_PRINTER.get(old_pid)
+            if old_dq:
+                old_dq.popleft()
+                if not old_dq: del _DETECTS_BY_PRINTER[old_pid]
+        RECENT_DETECTS.append(rec)
+        pid = rec["printer_id"] or ""
+        dq = _DETECTS_BY_PRINTER.get(pid)
+        if dq is None:
+            dq = _DETECTS_BY_PRINTER[pid] = deque()
+        dq.append(rec)
     except Exception:
         pass
 
@@ -1006,17 +1154,19 @@ class DetectSSEBroker:
     async def subscribe(self) -> asyncio.Queue:
         q = asyncio.Queue(maxsize=500); self.subs.add(q); return q
     def unsubscribe(self, q: asyncio.Queue): self.subs.discard(q)
-    async def publish(self, payload: dict):
-        dead=[]
-        for q in list(self.subs):
-            try: await q.put(payload)
-            except Exception: dead.append(q)
-        for q in dead: self.unsubscribe(q)
+    async def publish(self, payload: Union[dict, str]):
+        subs = list(self.subs)
+        if not subs: return
+        frame = _sse_data(payload)
+        for q in subs:
+            if not _offer(q, frame): self.unsubscribe(q)
 
 detect_broker = DetectSSEBroker()
 
 # ---- Debounce confirm state ----
 _PENDING_ISSUES: dict[tuple[str,str], dict] = {}
+# ชื่อ class จาก detector มีไม่กี่แบบ แต่มาทุกเฟรม → cache ผล normalize ไว้ (pure function)
+@functools.lru_cache(maxsize=512)
 def _norm(s: str) -> str: return (s or "").strip().lower().replace("-", "_").replace("  "," ").replace(" ","_")
 def _norm_cls(s: Optional[str]) -> str: return _norm(s or "")
 def _pend_key(printer_id: str, clsname: str) -> tuple[str,str]:
@@ -1028,9 +1178,20 @@ def _now_ts_fallback(ts: Optional[float]) -> float:
     except Exception:
         return datetime.utcnow().timestamp()
 
+# คิวหมดอายุ (min-heap ของ (เวลาที่ควรตรวจ, key)): 1 รายการต่อ key ที่ค้างอยู่
+# _gc_pending ดูแค่หัว heap → ไม่มีอะไรหมดอายุก็จบทันที ไม่ต้องไล่ทุก key
+_PENDING_EXP: list[tuple[float, tuple[str,str]]] = []
+
+def _pending_ttl() -> float:
+    return 2.0 * max(1.0, DETECT_CONFIRM_WINDOW_SEC)
+
 def _add_pending_hit(printer_id: str, clsname: str, *, ts: float, conf: float, payload: dict):
     k = _pend_key(printer_id, clsname)
-    st = _PENDING_ISSUES.get(k) or {"first_ts": ts, "last_ts": ts, "hits": 0, "sum_conf": 0.0, "max_conf": 0.0, "last_payload": None}
+    st = _PENDING_ISSUES.get(k)
+    if st is None:
+        st = {"first_ts": ts, "last_ts": ts, "hits": 0, "sum_conf": 0.0, "max_conf": 0.0, "last_payload": None,
+              "gc_at": ts + _pending_ttl()}
+        heapq.heappush(_PENDING_EXP, (st["gc_at"], k))
     st["hits"] += 1; st["last_ts"] = ts; st["sum_conf"] += float(conf or 0.0); st["max_conf"] = max(st["max_conf"], float(conf or 0.0))
     st["last_payload"] = payload
     _PENDING_ISSUES[k] = st
@@ -1048,29 +1209,61 @@ def _check_confirm(st: dict) -> tuple[bool, float]:
     ), mean_conf
 
 def _gc_pending():
-    cutoff = datetime.utcnow().timestamp() - (2.0 * max(1.0, DETECT_CONFIRM_WINDOW_SEC))
-    for k, st in list(_PENDING_ISSUES.items()):
+    ttl = _pending_ttl()
+    now = datetime.utcnow().timestamp(); cutoff = now - ttl
+    while _PENDING_EXP and _PENDING_EXP[0][0] < now:
+        at, k = heapq.heappop(_PENDING_EXP)
+        st = _PENDING_ISSUES.get(k)
+        if st is None or st.get("gc_at") != at: continue   # ถูก clear/สร้างใหม่ไปแล้ว = รายการค้าง
         if st.get("last_ts", 0) < cutoff:
             _PENDING_ISSUES.pop(k, None)
+        else:
+            # มี hit ใหม่หลังจากใส่ heap → เลื่อนเวลาตรวจตาม last_ts ล่าสุด
+            st["gc_at"] = st["last_ts"] + ttl
+            heapq.heappush(_PENDING_EXP, (st["gc_at"], k))
 
 # =============================================================================
 # Sticky alert watchdog (HoloLens panel)
 # =============================================================================
-_PAUSE_PANEL_ON: Dict[str, bool] = {}
-async def _panel_watchdog(printer_id: str, payload: dict, interval: float = 12.0):
+# 1 watchdog ต่อเครื่อง: pid → generation ของตัวที่กำลังรัน (ไม่มี key = ไม่มี watchdog)
+# เจอ detect ซ้ำระหว่าง panel ยังค้าง → แค่อัปเดต payload ตัวที่รันอยู่ ไม่สร้าง loop ยิงซ้อน
+_PANEL_GEN: Dict[str, int] = {}
+_PANEL_PAYLOAD: Dict[str, dict] = {}
+_panel_gen_seq = 0
+
+def _start_panel_watchdog(printer_id: str, payload: dict, interval: float = 12.0) -> None:
+    global _panel_gen_seq
     pid = (printer_id or "-").strip().lower()
-    _PAUSE_PANEL_ON[pid] = True
+    _PANEL_PAYLOAD[pid] = payload
+    if pid in _PANEL_GEN: return
+    _panel_gen_seq += 1; _PANEL_GEN[pid] = _panel_gen_seq
+    _spawn(_panel_watchdog, pid, _panel_gen_seq, interval=interval)
+
+async def _panel_watchdog(pid: str, gen: int, interval: float = 12.0):
+    # stop แล้ว start ใหม่ระหว่างที่ตัวเก่ายัง sleep → generation ไม่ตรง ตัวเก่าเลิกเอง
+    alive = lambda: _PANEL_GEN.get(pid) == gen
     try:
-        await _emit_printer_event(pid, payload)
-        while _PAUSE_PANEL_ON.get(pid, False):
-            await asyncio.sleep(interval)
-            await _emit_printer_event(pid, payload)
+        await _emit_printer_event(pid, _PANEL_PAYLOAD.get(pid) or {})
+        # fixed-rate: นับรอบถัดไปจาก deadline เดิม ไม่ใช่หลัง emit เสร็จ (กันรอบยืดตามเวลา emit)
+        loop = asyncio.get_running_loop()
+        next_t = loop.time() + interval
+        while alive():
+            await asyncio.sleep(max(0.0, next_t - loop.time()))
+            if not alive(): break
+            await _emit_printer_event(pid, _PANEL_PAYLOAD.get(pid) or {})
+            next_t += interval
+            if next_t <= loop.time():
+                # emit ช้ากว่า interval → ข้ามรอบที่พลาด ไม่ยิงถี่ไล่ตาม
+                next_t = loop.time() + interval
     except Exception:
         log.exception("[PANEL] watchdog error")
     finally:
-        _PAUSE_PANEL_ON[pid] = False
+        if alive():
+            _PANEL_GEN.pop(pid, None); _PANEL_PAYLOAD.pop(pid, None)
 
-def _stop_panel_watchdog(printer_id: str): _PAUSE_PANEL_ON[(printer_id or "-").strip().lower()] = False
+def _stop_panel_watchdog(printer_id: str):
+    pid = (printer_id or "-").strip().lower()
+    _PANEL_GEN.pop(pid, None); _PANEL_PAYLOAD.pop(pid, None)
 
 async def _close_sticky_panel(printer_id: str, persist_key: str):
     _stop_panel_watchdog(printer_id)
@@ -1084,15 +1277,20 @@ async def _close_sticky_panel(printer_id: str, persist_key: str):
 # =============================================================================
 # Octo pause helpers
 # =============================================================================
+# pause ต้องไวตอนเจอ defect → ใช้ connection ค้างไว้กับ OctoPrint แทนเปิดใหม่ทุกครั้ง
+_OCTO_HTTP = SharedAsyncClient(
+    timeout=httpx.Timeout(connect=5.0, read=5.0, write=5.0, pool=5.0),
+    limits=httpx.Limits(max_keepalive_connections=4, max_connections=8),
+)
+
 async def _pause_octoprint() -> None:
     if not _octo_ready():
         log.warning("[PAUSE] OctoPrint not configured; skip")
         return
     url = f"{OCTO_BASE}/api/job"
     payload = {"command":"pause","action":"pause"}
-    timeout = httpx.Timeout(connect=5.0, read=5.0, write=5.0, pool=5.0)
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
+        async with _OCTO_HTTP.client() as client:
             r = await client.post(url, headers={**_octo_headers(),"Content-Type":"application/json"}, json=payload)
             log.info("[PAUSE] POST %s -> %s %s", url, r.status_code, r.text[:200]); r.raise_for_status()
     except httpx.HTTPError:
@@ -1108,13 +1306,28 @@ def _pause_current_job_in_db(db: Session, printer_id: str) -> Optional[PrintJob]
              .first())
     if not job: return None
     job.status = "paused"; db.add(job); db.commit(); db.refresh(job)
+    invalidate_active_owner(pid)
     return job
 
+# 1 = เรียก handler ใน printer_status ตรง ๆ (โปรเซสเดียวกัน) ไม่วน HTTP กลับเข้าตัวเอง
+# 0 = ยิงผ่าน BACKEND_INTERNAL_BASE (กรณีแยก printer_status ไปอีกโฮสต์)
+INTERNAL_CALL_LOCAL = _as_bool(os.getenv("INTERNAL_CALL_LOCAL"), True)
+
 async def _backend_read_job(printer_id: str) -> dict:
     pid = (printer_id or DEFAULT_PRINTER_ID or "-").strip().lower()
+    if INTERNAL_CALL_LOCAL:
+        try:
+            from printer_status import octoprint_job as _octoprint_job_local  # type: ignore
+        except Exception:
+            log.exception("[internal-call] printer_status not importable, fallback HTTP")
+        else:
+            try:
+                return await _octoprint_job_local(pid, force=True)
+            except Exception:
+                return {}
     url = f"{BACKEND_INTERNAL_BASE}/printers/{pid}/octoprint/job?force=1"
     try:
-        async with httpx.AsyncClient(timeout=10) as c:
+        async with _INTERNAL_HTTP.client() as c:
             r = await c.get(url); r.raise_for_status(); return r.json()
     except Exception:
         return {}
@@ -1123,48 +1336,41 @@ async def _backend_read_job(printer_id: str) -> dict:
 # Dedupe/suppress (job events)
 # =============================================================================
 JOB_EVENT_DEDUP_TTL_SEC = int(_as_float(os.getenv("JOB_EVENT_DEDUP_TTL_SEC"), 15))
-_recent_job_events: Dict[str, datetime] = {}
-
-def _dupkey(printer_id: str, job_id: Union[int,str,None], status: str) -> str:
-    return f"{(printer_id or '').lower()}|{job_id or '-'}|{(status or '').lower()}"
+_recent_job_events = _TTLMap(JOB_EVENT_DEDUP_TTL_SEC, 500)
 
-def _should_skip_job_event(printer_id: str, job_id: Union[int,str,None], status: str) -> bool:
-    now = datetime.utcnow(); k = _dupkey(printer_id, job_id, status); ts = _recent_job_events.get(k)
-    if ts and (now - ts).total_seconds() < JOB_EVENT_DEDUP_TTL_SEC: return True
-    _recent_job_events[k] = now
-    if len(_recent_job_events) > 500:
-        cutoff = now - timedelta(seconds=JOB_EVENT_DEDUP_TTL_SEC*2)
-        for kk, vv in list(_recent_job_events.items()):
-            if vv < cutoff: _recent_job_events.pop(kk, None)
-    return False
+def _job_event_key(printer_id: str, job_id: Union[int,str,None], status: str) -> Tuple[str, str, str]:
+    return ((printer_id or "").lower(), str(job_id or "-"), (status or "").lower())
 
 ANNOUNCE_TTL_HOURS = int(_as_float(os.getenv("ANNOUNCE_TTL_HOURS"), 12))
-ANNOUNCED_JOB_STATUS: Dict[Tuple[str,int,str], datetime] = {}
-def _announced(printer_id: str, job_id: Optional[int], status: str) -> bool:
-    if not job_id: return False
-    k = ((printer_id or "").lower(), int(job_id), (status or "").lower())
-    ts = ANNOUNCED_JOB_STATUS.get(k)
-    if not ts: return False
-    if (datetime.utcnow() - ts).total_seconds() > ANNOUNCE_TTL_HOURS*3600:
-        ANNOUNCED_JOB_STATUS.pop(k, None); return False
-    return True
+ANNOUNCED_JOB_STATUS = _TTLMap(ANNOUNCE_TTL_HOURS*3600, 2000)
+
+def _claim_job_event(printer_id: str, job_id: Union[int,str,None], status: str) -> Optional[str]:
+    """
+    ตรวจ+จองสิทธิ์ส่ง job event ในจังหวะเดียว (key ชุดเดียวใช้ทั้งสอง map)
+    คืน None = ให้ส่งต่อได้ (จดไว้ใน dedupe สั้นแล้ว), ไม่งั้นคืนเหตุผลที่ข้าม
+    announced จดแยกด้วย _mark_announced หลังส่งสำเร็จ (อายุยาวกว่า dedupe มาก)
+    """
+    k = _job_event_key(printer_id, job_id, status)
+    if job_id and ANNOUNCED_JOB_STATUS.seen(k): return "already_announced"
+    if _recent_job_events.check_and_mark(k): return "duplicate_recent"
+    return None
+
 def _mark_announced(printer_id: str, job_id: Optional[int], status: str):
     if not job_id: return
-    k = ((printer_id or "").lower(), int(job_id), (status or "").lower())
-    ANNOUNCED_JOB_STATUS[k] = datetime.utcnow()
+    ANNOUNCED_JOB_STATUS.mark(_job_event_key(printer_id, job_id, status))
 
 SUPPRESS_AFTER_CANCEL_SEC = int(_as_float(os.getenv("SUPPRESS_AFTER_CANCEL_SEC"), 25))
-_SUPPRESS_UNTIL: Dict[str, datetime] = {}
+_SUPPRESS_UNTIL: Dict[str, float] = {}   # printer → time.monotonic() ที่หมด suppress (1 แถวต่อเครื่อง ไม่ต้องจำกัดขนาด)
 def _suppress_after_cancel(printer_id: str, seconds: Optional[int] = None) -> None:
     sec = int(seconds or SUPPRESS_AFTER_CANCEL_SEC); pid = (printer_id or "").strip().lower()
     if not pid or sec <= 0: return
-    _SUPPRESS_UNTIL[pid] = datetime.utcnow() + timedelta(seconds=sec)
+    _SUPPRESS_UNTIL[pid] = time.monotonic() + sec
 def _is_suppressed(printer_id: str) -> Optional[str]:
     pid = (printer_id or "").strip().lower(); until = _SUPPRESS_UNTIL.get(pid)
-    if not until: return None
-    now = datetime.utcnow()
-    if now >= until: _SUPPRESS_UNTIL.pop(pid, None); return None
-    return until.isoformat()
+    if until is None: return None
+    left = until - time.monotonic()
+    if left <= 0: _SUPPRESS_UNTIL.pop(pid, None); return None
+    return (datetime.utcnow() + timedelta(seconds=left)).isoformat()
 
 # =============================================================================
 # Schemas
@@ -1198,13 +1404,24 @@ class JobEventIn(BaseModel):
     confidence: Optional[float] = None
     finished_at: Optional[datetime] = None
 
+_TITLE_SEV_BY_STATUS: Dict[str, Tuple[str,str]] = {
+    "completed": ("🎉 Print completed", "success"),
+    "cancelled": ("🚫 Print cancelled", "warning"),
+}
+_TITLE_SEV_DEFAULT = ("❌ Print failed", "critical")
+
 def _status_title_severity(st: str) -> Tuple[str,str]:
-    if st == "completed": return "🎉 Print completed","success"
-    if st == "cancelled": return "🚫 Print cancelled","warning"
-    return "❌ Print failed","critical"
+    return _TITLE_SEV_BY_STATUS.get(st, _TITLE_SEV_DEFAULT)
+
+# หัวข้อของ issue_* (event ถูก normalize ใน ingest_detect_alert แล้ว)
+_TITLE_BY_EVENT: Dict[str, str] = {
+    "issue_started": "Anomaly detected",
+    "issue_update": "Anomaly update",
+    "issue_cleared": "Back to normal",
+}
 
 def _auto_severity(event: str, conf: float | None) -> str:
-    e = (event or "").lower().strip(); c = float(conf or 0.0)
+    e = event or ""; c = float(conf or 0.0)
     if e == "issue_started": return "critical" if c >= 0.80 else "warning"
     if e == "issue_update":  return "warning"  if c >= 0.70 else "info"
     return "info"
@@ -1214,19 +1431,38 @@ def _parse_employees_csv(s: str | None) -> list[str]:
 
 DEFAULT_ALERT_RECIPIENTS: list[str] = _parse_employees_csv(os.getenv("ALERT_DEFAULT_EMPLOYEES"))
 
+# detector ยิงถี่ (หลายครั้ง/วินาที) แต่งานบนเตียงเปลี่ยนไม่บ่อย → จำผลไว้สั้น ๆ ต่อเครื่อง
+# จำเฉพาะตอนเจอเจ้าของ: "ไม่มีงาน" ไม่ cache เพราะงานเริ่ม (ใน print_queue/printer_status) ได้ทุกเมื่อ
+# และเป็นจังหวะที่ alert เริ่มเข้ามาพอดี
+ACTIVE_OWNER_CACHE_TTL = _as_float(os.getenv("ACTIVE_OWNER_CACHE_TTL"), 2.0)
+_ACTIVE_OWNER_CACHE: Dict[str, Tuple[float, str]] = {}
+
+def invalidate_active_owner(printer_id: Optional[str]) -> None:
+    """เรียกหลัง commit ทุกครั้งที่ PrintJob.status ของเครื่องนี้เปลี่ยน (เริ่ม/pause/resume/จบ/ยกเลิก)
+    ไม่งั้น alert/DM ช่วง TTL ยังไปหาเจ้าของงานก่อนหน้า"""
+    _ACTIVE_OWNER_CACHE.pop((printer_id or DEFAULT_PRINTER_ID or "-").strip().lower(), None)
+
 def _find_active_owner(db: Session, printer_id: str) -> Optional[str]:
     """
     ตอนนี้ตีความว่า 'owner' = คนที่ควรถูกแจ้งเตือนหลักของงานบนเตียง
     (requested_by_employee_id ถ้ามี, ถ้าไม่มีค่อย fallback employee_id)
     """
     pid = (printer_id or DEFAULT_PRINTER_ID or "-").strip().lower()
-    job = (db.query(PrintJob)
+    now = time.monotonic()
+    hit = _ACTIVE_OWNER_CACHE.get(pid)
+    if hit and now - hit[0] < ACTIVE_OWNER_CACHE_TTL:
+        return hit[1]
+    # ต้องการแค่ 2 คอลัมน์ ไม่ต้องโหลดทั้งแถว (Row มี attribute ชื่อเดียวกับ PrintJob)
+    job = (db.query(PrintJob.requested_by_employee_id, PrintJob.employee_id)
              .filter(PrintJob.printer_id == pid, PrintJob.status.in_(("processing","printing","paused")))
              .order_by(PrintJob.started_at.desc().nullslast(), PrintJob.id.desc())
              .first())
-    if not job:
-        return None
-    return _primary_emp_from_job(job)
+    owner = _primary_emp_from_job(job) if job else None
+    if owner:
+        _ACTIVE_OWNER_CACHE[pid] = (now, owner)
+    else:
+        _ACTIVE_OWNER_CACHE.pop(pid, None)
+    return owner
 
 def _normalize_recipients(recipients: list[str] | None) -> list[str]:
     return [ (r or "").strip() for r in (recipients or []) if (r or "").strip() ]
@@ -1253,7 +1489,7 @@ def list_notifications(
 ):
     limit = max(1, min(int(limit or 20), 100))
     try:
-        q = (db.query(Notification, NotificationTarget.read_at)
+        q = (db.query(*_NOTIF_LIST_COLS)
                .join(NotificationTarget, Notification.id == NotificationTarget.notification_id)
                .filter(NotificationTarget.employee_id == current.employee_id)
                .order_by(Notification.id.desc())
@@ -1268,15 +1504,20 @@ async def create_notification(
     db: Session = Depends(get_db),
     current: User = Depends(get_user_from_header_or_query),
 ):
+    """
+    สร้างแจ้งเตือนถึงผู้รับ (ไม่ระบุ = ตัวเอง)
+
+    response: 1 รายการต่อผู้รับ (ตัดซ้ำ/ค่าว่างแล้ว) เรียงตาม recipients
+    ⚠️ ผู้รับทุกคนใช้ notification แถวเดียวกัน → ทุกรายการมี `id` เดียวกัน
+    ห้ามใช้ `id` เป็น key แยกรายการใน response นี้ (ใช้ index ตามลำดับผู้รับแทน)
+    """
     recipients = (payload.recipients or [current.employee_id])[:200]
-    out: List[NotificationOut] = []
-    for emp in recipients:
-        n = await notify_user(
-            db, emp, type=payload.type, title=payload.title,
-            message=payload.message, severity=payload.severity, data=payload.data or {}
-        )
-        out.append(_to_out(n, read_at=None))
-    return out
+    emps = list(dict.fromkeys(e for e in recipients if e))   # ชุดเดียวกับที่ notify_many ส่งจริง
+    n = await notify_many(
+        db, emps, type=payload.type, title=payload.title,
+        message=payload.message, severity=payload.severity, data=payload.data or {}
+    )
+    return [_to_out(n, read_at=None)] * len(emps) if n else []
 
 @router.post("/mark-read")
 def mark_read(
@@ -1312,20 +1553,21 @@ def delete_notification(
     db: Session = Depends(get_db),
     current: User = Depends(get_user_from_header_or_query),
 ):
-    target = (db.query(NotificationTarget)
-                .filter(NotificationTarget.employee_id == current.employee_id,
-                        NotificationTarget.notification_id == notif_id)
-                .first())
-    if not target: raise HTTPException(status_code=404, detail="Not found")
-
-    db.delete(target); db.commit()
-
-    remaining = (db.query(NotificationTarget)
-                   .filter(NotificationTarget.notification_id == notif_id)
-                   .count())
-    if remaining == 0:
-        n = db.query(Notification).filter(Notification.id == notif_id).first()
-        if n: db.delete(n); db.commit()
+    # ลบระดับ query ตรง ๆ: ไม่ต้องโหลด target/notification ขึ้นมาเป็น object
+    # และไม่ให้ cascade ของ Notification.targets ไป SELECT target ทั้งหมดซ้ำอีกรอบ
+    deleted = (db.query(NotificationTarget)
+                 .filter(NotificationTarget.employee_id == current.employee_id,
+                         NotificationTarget.notification_id == notif_id)
+                 .delete(synchronize_session=False))
+    if not deleted:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # ผู้รับคนสุดท้ายลบแล้ว → ลบตัว notification ด้วย (ใน transaction เดียวกัน)
+    (db.query(Notification)
+       .filter(Notification.id == notif_id, ~Notification.targets.any())
+       .delete(synchronize_session=False))
+    db.commit()
     return {"ok": True}
 
 # =============================================================================
@@ -1348,7 +1590,7 @@ async def stream(
             if init_limit > 0:
                 db2 = SessionLocal()
                 try:
-                    rows = (db2.query(Notification, NotificationTarget.read_at)
+                    rows = (db2.query(*_NOTIF_LIST_COLS)
                               .join(NotificationTarget, Notification.id == NotificationTarget.notification_id)
                               .filter(NotificationTarget.employee_id == emp)
                               .order_by(Notification.id.desc())
@@ -1360,13 +1602,8 @@ async def stream(
                 finally:
                     db2.close()
 
-            while True:
-                try:
-                    event = await asyncio.wait_for(q.get(), timeout=25)
-                    yield f"data: {_json(event)}\n\n"
-                except asyncio.TimeoutError:
-                    if await request.is_disconnected(): break
-                    yield ":keepalive\n\n"
+            async for frame in _sse_pump(request, q):
+                yield frame
         finally:
             broker.unsubscribe(emp, q)
 
@@ -1388,7 +1625,9 @@ async def ingest_detect_alert(
     if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    log.info("[ALERT] recv %s", payload.model_dump_json(indent=0))
+    if log.isEnabledFor(logging.INFO):   # ไม่ต้อง encode ทั้ง payload ถ้า log ระดับนี้ปิดอยู่
+        log.info("[ALERT] recv %s", payload.model_dump_json(indent=0))
+    payload_dict = payload.model_dump()   # dump ครั้งเดียว ใช้ทั้ง debounce และ data ของการแจ้งเตือน
 
     # ===== LATENCY: camera -> backend ingest =====
     try:
@@ -1442,6 +1681,13 @@ async def ingest_detect_alert(
 
     _push_detect(base); _spawn(detect_broker.publish, base)
 
+    # ฟิลด์ร่วมของ issue_* ที่ส่งเข้า printer stream/Unity — สร้างครั้งเดียว แต่ละกรณีเติมเฉพาะที่ต่าง
+    issue_base = {
+        "issue_active": event != "issue_cleared", "event": event, "printer_id": printer_id,
+        "detected_class": payload.detected_class, "confidence": payload.confidence,
+        "image_url": payload.image_url, "video_url": payload.video_url, "ts": payload.ts,
+    }
+
     # bed_empty / bed_occupied (internal only; no user DM)
     if clsname in {"bed_occupied","bedoccupied","bed_empty","bedempty"}:
         if clsname.startswith("bed_empty") or clsname == "bedempty":
@@ -1471,21 +1717,16 @@ async def ingest_detect_alert(
         return {"ok": True, "skipped": f"ignored bed status ({clsname})"}
 
     if event == "issue_update" and not ALERT_ON_UPDATE:
-        await _emit_printer_event(printer_id, {
-            "issue_active": event != "issue_cleared", "event": event, "printer_id": printer_id,
-            "detected_class": payload.detected_class, "confidence": payload.confidence,
-            "image_url": payload.image_url, "video_url": payload.video_url, "ts": payload.ts,
-            "severity":"info","title":"Detector update (ignored by policy)","message": f"class={clsname} conf={conf:.2f}",
-        })
+        await _emit_printer_event(printer_id, _broadcast_defect(
+            issue_base, severity="info", title="Detector update (ignored by policy)",
+            message=f"class={clsname} conf={conf:.2f}",
+        ))
         return {"ok": True, "skipped": "update events are disabled"}
 
     if not clsname:
-        await _emit_printer_event(printer_id, {
-            "issue_active": event != "issue_cleared", "event": event, "printer_id": printer_id,
-            "detected_class": payload.detected_class, "confidence": payload.confidence,
-            "image_url": payload.image_url, "video_url": payload.video_url, "ts": payload.ts,
-            "severity":"info","title":"Detector event","message": f"class=? conf={conf:.2f}",
-        })
+        await _emit_printer_event(printer_id, _broadcast_defect(
+            issue_base, severity="info", title="Detector event", message=f"class=? conf={conf:.2f}",
+        ))
         return {"ok": True, "skipped": "no detected_class"}
 
     if event != "issue_cleared":
@@ -1495,12 +1736,9 @@ async def ingest_detect_alert(
             return {"ok": True, "skipped": f"low confidence {conf:.2f} < {MIN_DETECT_CONFIDENCE:.2f}"}
     else:
         if clsname not in ALLOWED_DETECT_CLASSES:
-            await _emit_printer_event(printer_id, {
-                "issue_active": False, "event": event, "printer_id": printer_id,
-                "detected_class": payload.detected_class, "confidence": payload.confidence,
-                "image_url": payload.image_url, "video_url": payload.video_url, "ts": payload.ts,
-                "severity":"info","title":"Cleared (ignored by policy)","message": f"class={clsname}",
-            })
+            await _emit_printer_event(printer_id, _broadcast_defect(
+                issue_base, severity="info", title="Cleared (ignored by policy)", message=f"class={clsname}",
+            ))
             return {"ok": True, "skipped": "cleared for non-allowed class"}
 
         # ==========================
@@ -1508,7 +1746,7 @@ async def ingest_detect_alert(
     # ==========================
     if DETECT_CONFIRM_ENABLED and event in {"issue_started","issue_update"}:
         ts_now = _now_ts_fallback(payload.ts)
-        st = _add_pending_hit(printer_id, clsname, ts=ts_now, conf=conf, payload=payload.model_dump())
+        st = _add_pending_hit(printer_id, clsname, ts=ts_now, conf=conf, payload=payload_dict)
         _gc_pending()
         confirmed, mean_conf = _check_confirm(st)
 
@@ -1536,11 +1774,7 @@ async def ingest_detect_alert(
 
     # Confirmed anomaly or cleared
     sev = payload.severity or _auto_severity(event, conf)
-    title = {
-        "issue_started":"Anomaly detected",
-        "issue_update":"Anomaly update",
-        "issue_cleared":"Back to normal",
-    }[event]
+    title = _TITLE_BY_EVENT[event]
 
     # ===== LATENCY: camera -> emit issue_* event =====
     now_ts2 = datetime.utcnow().timestamp()
@@ -1566,7 +1800,7 @@ async def ingest_detect_alert(
         f"boxes={len(payload.boxes or [])}  (Bangkok time { _fmt_bkk() })"
     )
 
-    data = payload.model_dump()
+    data = dict(payload_dict)   # copy ตื้นพอ: แก้แค่ key ชั้นบน (payload_dict อาจค้างอยู่ใน pending state)
     data["printer_id"] = printer_id
     if job_id is not None:
         data["job_id"] = job_id
@@ -1613,7 +1847,7 @@ async def ingest_detect_alert(
                     "owner_employee_id": (job.employee_id or "").strip(),
                     "requested_by_employee_id": (getattr(job, "requested_by_employee_id", "") or "").strip(),
                 }
-                _spawn(_panel_watchdog, printer_id, panel_payload, interval=12.0)
+                _start_panel_watchdog(printer_id, panel_payload, interval=12.0)
 
                 # แจ้งเจ้าของจริง: BOTH paused + issue (same reason)
                 ev_paused = format_canonical_event(
@@ -1640,20 +1874,18 @@ async def ingest_detect_alert(
 
     # broadcast anomaly / cleared (ใส่ชื่อ/ไอดีงานด้วย)
     current_owner = _find_active_owner(db, printer_id)
-    await _emit_printer_event(printer_id, {
-        "issue_active": event != "issue_cleared", "event": event, "printer_id": printer_id,
-        "detected_class": payload.detected_class, "confidence": payload.confidence,
-        "image_url": payload.image_url, "video_url": payload.video_url, "boxes": payload.boxes,
-        "image_w": payload.image_w, "image_h": payload.image_h, "ts": payload.ts,
-        "severity": sev, "title": title, "message": msg,
-        "owner_employee_id": (current_owner or ""),
-        "name": job_name or None,
-        "job_id": job_id if job_id is not None else None,
-        "reason": clsname, "reason_label": reason_txt,
+    await _emit_printer_event(printer_id, _broadcast_defect(
+        issue_base,
+        boxes=payload.boxes, image_w=payload.image_w, image_h=payload.image_h,
+        severity=sev, title=title, message=msg,
+        owner_employee_id=(current_owner or ""),
+        name=job_name or None,
+        job_id=job_id,
+        reason=clsname, reason_label=reason_txt,
         # NEW: latency info to UI
-        "lat_cam_to_backend": round(lat_cam_to_backend, 3),
-        "lat_cam_to_emit": round(lat_cam_to_emit, 3),
-    })
+        lat_cam_to_backend=base["lat_cam_to_backend"],
+        lat_cam_to_emit=round(lat_cam_to_emit, 3),
+    ))
 
     # notify recipients -> ใช้ canonical event เดียวกัน
     recipients = _normalize_recipients(payload.recipients)
@@ -1705,8 +1937,8 @@ async def job_event(
     reason_txt = _reason_label(cls_norm)
     conf = float(payload.confidence or 0.0)
 
-    if _announced(printer_id, job.id, payload.status): return {"ok": True, "skipped":"already_announced"}
-    if _should_skip_job_event(printer_id, job.id, payload.status): return {"ok": True, "skipped":"duplicate_recent"}
+    skip = _claim_job_event(printer_id, job.id, payload.status)
+    if skip: return {"ok": True, "skipped": skip}
 
     if payload.status in ("cancelled","failed"): _suppress_after_cancel(printer_id)
 
@@ -1756,14 +1988,16 @@ async def job_event(
 # =============================================================================
 # RECENT DETECTS: REST + SSE + simple view (debug/monitor)
 # =============================================================================
-def _flt_detects(*, printer_id: str | None, detected_class: str | None, event: str | None, since_ts: float | None) -> list[DetectRecord]:
-    out: list[DetectRecord] = []
-    for rec in reversed(RECENT_DETECTS):
-        if printer_id and (rec.printer_id or "") != printer_id: continue
-        if detected_class and (rec.detected_class or "") != detected_class: continue
-        if event and (rec.event or "") != event: continue
-        if since_ts is not None and float(rec.ts or 0) < float(since_ts): continue
+def _flt_detects(*, printer_id: str | None, detected_class: str | None, event: str | None, since_ts: float | None,
+                 limit: int | None = None) -> list[dict]:
+    out: list[dict] = []
+    src = _DETECTS_BY_PRINTER.get(printer_id, ()) if printer_id else RECENT_DETECTS
+    for rec in reversed(src):
+        if detected_class and (rec["detected_class"] or "") != detected_class: continue
+        if event and (rec["event"] or "") != event: continue
+        if since_ts is not None and rec["ts"] < float(since_ts): continue
         out.append(rec)
+        if limit and len(out) >= limit: break
     return out
 
 @router.get("/detects")
@@ -1782,8 +2016,7 @@ def list_detects(
     pid = (printer_id or "").strip().lower() or None
     cls = (detected_class or "").strip().lower() or None
     evt = (event or "").strip() or None
-    recs = _flt_detects(printer_id=pid, detected_class=cls, event=evt, since_ts=since_ts)
-    return [r.model_dump() for r in recs[:limit]]
+    return _flt_detects(printer_id=pid, detected_class=cls, event=evt, since_ts=since_ts, limit=limit)
 
 @router.get("/detects/stream")
 async def stream_detects(
@@ -1798,13 +2031,8 @@ async def stream_detects(
     async def gen():
         yield ":ok\n\n"
         try:
-            while True:
-                try:
-                    item = await asyncio.wait_for(q.get(), timeout=25)
-                    yield f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
-                except asyncio.TimeoutError:
-                    if await request.is_disconnected(): break
-                    yield ":keepalive\n\n"
+            async for frame in _sse_pump(request, q):
+                yield frame
         finally:
             detect_broker.unsubscribe(q)
     headers = {
@@ -417,12 +417,13 @@ def delete_my_history_bulk(
         cutoff = datetime.utcnow() - timedelta(days=older_than_days)
         qry = qry.filter((PrintJob.finished_at == None) | (PrintJob.finished_at < cutoff))  # noqa: E711
 
-    to_delete = qry.all()
-    for row in to_delete:
-        db.delete(row)
-    db.commit()
+    # DELETE ... WHERE ตรง ๆ คำสั่งเดียว (PrintJob ไม่มี ORM cascade ที่ต้องโหลดแถวมาก่อน)
+    # ไม่มีอะไรให้ลบ = ไม่ต้อง commit
+    deleted = qry.delete(synchronize_session=False)
+    if deleted:
+        db.commit()
 
-    return {"ok": True, "deleted": len(to_delete)}
+    return {"ok": True, "deleted": int(deleted or 0)}
 
 
 # -------------------------------------------------------------------
@@ -30,6 +30,7 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from db import get_db
+from http_pool import SharedAsyncClient
 from auth import (
     get_current_user,
     get_confirmed_user,
@@ -62,6 +63,13 @@ except Exception:  # pragma: no cover
         return None
 
 
+try:
+    from notifications import invalidate_active_owner  # type: ignore
+except Exception:  # pragma: no cover
+    def invalidate_active_owner(printer_id):  # type: ignore
+        return None
+
+
 # fire-and-forget helper
 def _bgcall(func_or_coro, /, *args, **kwargs):
     try:
@@ -373,6 +381,13 @@ BACKEND_INTERNAL_BASE = (
     or "http://127.0.0.1:8001"
 ).rstrip("/")
 
+# loopback ไป backend ตัวเอง: ใช้ client keep-alive ร่วมกัน ไม่เปิด TCP ใหม่ทุกครั้ง
+_INTERNAL_HTTP = SharedAsyncClient(
+    timeout=httpx.Timeout(10.0, connect=2.0),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    follow_redirects=True,
+)
+
 PUBLIC_BASE_URL = (os.getenv("PUBLIC_BASE_URL") or "").strip().strip('"').strip("'")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "Delta")
 
@@ -465,8 +480,8 @@ async def _bed_empty_recent_async(printer_id: str) -> bool:
     params = {"printer_id": _norm_printer_id(printer_id)}
     headers = {"X-Admin-Token": ADMIN_TOKEN}
     try:
-        async with httpx.AsyncClient(timeout=6.0, follow_redirects=True) as c:
-            r = await c.get(url, params=params, headers=headers)
+        async with _INTERNAL_HTTP.client() as c:
+            r = await c.get(url, params=params, headers=headers, timeout=6.0)
             if r.status_code != 200:
                 logger.info(
                     "[QUEUE] bed-status HTTP %s: %s", r.status_code, r.text[:200]
@@ -798,8 +813,7 @@ def _ensure_storage_record(
 
     row = StorageFile(
         employee_id=_emp(employee_id),
-        filename=(filename_hint or base),
-        name="",
+        filename=(filename_hint or base),  # name/name_low ได้จาก default ของคอลัมน์ (fallback เป็น filename)
         object_key=object_key,
         content_type=ct,
         size=size,
@@ -978,10 +992,13 @@ def _find_storage_file_id(
 
 
 # --------------------------- preview helpers ---------------------------------
+_GCODE_EXT_RE = re.compile(r"\.(gcode|gco|gc)$", re.I)
+
+
 def _preview_key_for(gcode_key: Optional[str]) -> Optional[str]:
     if not gcode_key:
         return None
-    return re.sub(r"\.(gcode|gco|gc)$", ".preview.png", gcode_key, flags=re.I)
+    return _GCODE_EXT_RE.sub(".preview.png", gcode_key, count=1)
 
 
 def _thumb_to_url(thumb: Optional[str]) -> Optional[str]:
@@ -1281,6 +1298,7 @@ async def _dispatch_to_octoprint(
         db.add(job)
         db.commit()
         db.refresh(job)
+        invalidate_active_owner(job.printer_id)
         ev = _format_event(
             type="print.issue",
             printer_id=job.printer_id,
@@ -1309,6 +1327,7 @@ async def _dispatch_to_octoprint(
         db.add(job)
         db.commit()
         db.refresh(job)
+        invalidate_active_owner(job.printer_id)
         evf = _format_event(
             type="print.issue",
             printer_id=job.printer_id,
@@ -1414,6 +1433,7 @@ async def _dispatch_to_octoprint(
         db.add(job)
         db.commit()
         db.refresh(job)
+        invalidate_active_owner(job.printer_id)
         evf = _format_event(
             type="print.issue",
             printer_id=job.printer_id,
@@ -1511,10 +1531,8 @@ def _notify_job_event_async(
                 "name": name,
             }
             timeout = httpx.Timeout(5.0, connect=2.0, read=2.0, write=2.0)
-            async with httpx.AsyncClient(
-                timeout=timeout, follow_redirects=True
-            ) as c:
-                r = await c.post(url, json=payload, headers=headers)
+            async with _INTERNAL_HTTP.client() as c:
+                r = await c.post(url, json=payload, headers=headers, timeout=timeout)
                 logger.info(
                     "[QUEUE] notify job-event (HTTP) %s → %s",
                     status_out,
@@ -1629,6 +1647,7 @@ def _start_next_job_if_idle(
     db.add(next_job)
     db.commit()
     db.refresh(next_job)
+    invalidate_active_owner(next_job.printer_id)
 
     logger.info(
         "[QUEUE] start-next: marked job#%s as processing (printer=%s, auto_start=%s)",
@@ -2110,6 +2129,7 @@ def patch_job(
     db.add(job)
     db.commit()
     db.refresh(job)
+    invalidate_active_owner(job.printer_id)
     return _to_out(db, current, job)
 
 
@@ -2117,17 +2137,27 @@ def patch_job(
 # cancel
 # -----------------------------------------------------------------------------#
 def _poll_octoprint_ready_and_chain(
-    db: Session, printer_id: str, max_wait_sec: float = 30.0, interval: float = 2.0
+    db: Session,
+    printer_id: str,
+    max_wait_sec: float = 30.0,
+    interval: float = 2.0,
+    max_interval: float = 8.0,
 ):
-    t0 = time.time()
-    while (time.time() - t0) < max_wait_sec:
+    # ถามซ้ำแบบ backoff (2 → 4 → 8s) ถ้า Octo ยังไม่พร้อม/ติดต่อไม่ได้ ไม่ยิงถี่ทุก 2s จนหมดเวลา
+    # รอบสุดท้ายตัดให้จบพอดี deadline
+    deadline = time.monotonic() + max_wait_sec
+    while True:
         if _octo_is_ready():
             _start_next_job_if_idle(db, printer_id, None)
             return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
         try:
-            time.sleep(interval)
+            time.sleep(min(interval, remaining))
         except Exception:
             break
+        interval = min(interval * 2, max_interval)
     _start_next_job_if_idle(db, printer_id, None)
 
 
@@ -2154,6 +2184,7 @@ def _cancel_job_instance(
     db.add(job)
     db.commit()
     db.refresh(job)
+    invalidate_active_owner(job.printer_id)
 
     ev = _format_event(
         type="print.canceled",
@@ -2249,6 +2280,7 @@ def pause_current(
     db.add(job)
     db.commit()
     db.refresh(job)
+    invalidate_active_owner(job.printer_id)
     return {"ok": True, "jobId": job.id, "status": job.status}
 
 
@@ -2274,22 +2306,22 @@ def resume_next(
     if not _owner_or_manager(current, job):
         raise HTTPException(403, "Forbidden")
 
+    # SessionLocal ตั้ง expire_on_commit=False และค่าที่แก้ตั้งจากฝั่ง Python ทั้งหมด
+    # → หลัง commit ค่าใน job ตรงกับ DB แล้ว ไม่ต้อง refresh (SELECT ซ้ำ)
     if RESUME_DIRECT_PROCESSING:
         now = datetime.utcnow()
         job.status = "processing"
         if not job.started_at:
             job.started_at = now
-        db.add(job)
         db.commit()
-        db.refresh(job)
+        invalidate_active_owner(pid)
 
         _bind_runmap_remote(pid, job)
         return {"ok": True, "jobId": job.id, "status": job.status}
     else:
         job.status = "queued"
-        db.add(job)
         db.commit()
-        db.refresh(job)
+        invalidate_active_owner(pid)
         _start_next_job_if_idle(db, pid, background_tasks)
         return {"ok": True, "jobId": job.id, "status": job.status}
 
@@ -2359,6 +2391,7 @@ def internal_process_next(
             db.add(has_processing)
             db.commit()
             db.refresh(has_processing)
+            invalidate_active_owner(pid)
             _notify_job_event_async(
                 has_processing.id, "completed", pid, has_processing.name
             )
@@ -2402,6 +2435,7 @@ def internal_process_next(
                 db.add(has_processing)
                 db.commit()
                 db.refresh(has_processing)
+                invalidate_active_owner(pid)
                 _notify_job_event_async(
                     has_processing.id, "completed", pid, has_processing.name
                 )
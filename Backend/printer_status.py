@@ -15,6 +15,13 @@ from db import get_db, SessionLocal
 from models import Printer, User, PrintJob
 from schemas import PrinterStatusOut, PrinterHeartbeatIn, PrinterStatusUpdateIn
 from auth import get_confirmed_user, decode_token
+from http_pool import SharedAsyncClient
+
+try:
+    from notifications import invalidate_active_owner  # type: ignore
+except Exception:  # pragma: no cover
+    def invalidate_active_owner(printer_id):  # type: ignore
+        return None
 
 router = APIRouter(prefix="/printers", tags=["printers"])
 log = logging.getLogger("printer_status")
@@ -65,6 +72,16 @@ def _octo_ready() -> bool:
 def _octo_headers() -> Dict[str, str]:
     return {"X-Api-Key": OCTO_KEY, "Accept": "application/json"}
 
+# HTTP client ใช้ซ้ำ (keep-alive) แทนการสร้างใหม่ทุก poll/ทุกครั้งที่ยิง loopback
+_OCTO_HTTP = SharedAsyncClient(
+    timeout=OCTO_TIMEOUT,
+    limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+)
+_INTERNAL_HTTP = SharedAsyncClient(
+    timeout=httpx.Timeout(10.0, connect=2.0),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+)
+
 # in-memory rate-limit / cache / cooldown ต่อเครื่อง
 _OCTO_LAST_CALL: Dict[str, float] = {}
 _OCTO_LAST_DATA: Dict[str, dict] = {}
@@ -263,6 +280,7 @@ def _adopt_owner_and_name_from(db: Session, active: PrintJob, queued: PrintJob)
         active.updated_at = datetime.utcnow()
         db.add(active)
     db.commit(); db.refresh(active)
+    invalidate_active_owner(active.printer_id)
 
 def _reconcile_active_with_queue(db: Session, printer_id: str, cur_fname: str) -> Optional[PrintJob]:
     pid = _norm_pid(printer_id)
@@ -290,7 +308,7 @@ def _promote_latest_paused_to_processing(db: Session, printer_id: str) -> Option
     if not j.started_at:
         j.started_at = datetime.utcnow()
     j.status = "processing"
-    db.add(j); db.commit(); db.refresh(j)
+    db.add(j); db.commit(); db.refresh(j); invalidate_active_owner(pid)
     log.info("[HEAL] promote paused→processing #%s '%s'", j.id, j.name)
     return j
 
@@ -310,7 +328,7 @@ def _create_pseudo_job(db: Session, printer_id: str, file_name: Optional[str] =
         uploaded_at=datetime.utcnow(),
         started_at=datetime.utcnow(),
     )
-    db.add(j); db.commit(); db.refresh(j)
+    db.add(j); db.commit(); db.refresh(j); invalidate_active_owner(pid)
     log.info("[PSEUDO] create job #%s for %s (%s) owner=%s", j.id, pid, j.name, j.employee_id)
     return j
 
@@ -337,7 +355,7 @@ def _complete_current_job_in_db(db: Session, printer_id: str, status: str = "com
         prn.updated_at = datetime.utcnow()
         db.add(prn)
 
-    db.commit(); db.refresh(job)
+    db.commit(); db.refresh(job); invalidate_active_owner(pid)
     log.info("[CLOSE] job #%s -> %s", job.id, status)
     return job
 
@@ -356,7 +374,7 @@ def _complete_latest_processing_job(db: Session, printer_id: str, status: str =
     j.finished_at = datetime.utcnow()
     if status == "completed":
         j.progress = 100.0
-    db.add(j); db.commit(); db.refresh(j)
+    db.add(j); db.commit(); db.refresh(j); invalidate_active_owner(pid)
     log.info("[SAFEGUARD] closed latest job #%s -> %s", j.id, status)
     return j
 
@@ -383,7 +401,7 @@ def _reconcile_active_with_runmap(db: Session, printer_id: str) -> Optional[Prin
             active.name = rm["name"]; changed = True
         if changed:
             active.updated_at = datetime.utcnow()
-            db.add(active); db.commit(); db.refresh(active)
+            db.add(active); db.commit(); db.refresh(active); invalidate_active_owner(pid)
             log.info("[RUNMAP] adopt → active #%s owner=%s name='%s'", active.id, active.employee_id, active.name)
         return active
 
@@ -403,7 +421,7 @@ def _reconcile_active_with_runmap(db: Session, printer_id: str) -> Optional[Prin
                 j.status = "processing"
                 j.started_at = j.started_at or datetime.utcnow()
             j.updated_at = datetime.utcnow()
-            db.add(j); db.commit(); db.refresh(j)
+            db.add(j); db.commit(); db.refresh(j); invalidate_active_owner(pid)
             log.info("[RUNMAP] promote job #%s '%s' → processing", j.id, j.name)
             return j
 
@@ -522,12 +540,27 @@ def _map_octo_state(state_text: str) -> Tuple[str, str]:
     return "ready", "Printer is ready"
 
 async def _fetch_octo_job_and_printer() -> Tuple[dict, dict]:
-    async with httpx.AsyncClient(timeout=OCTO_TIMEOUT) as client:
-        job_r = await client.get(f"{OCTO_BASE}/api/job", headers=_octo_headers())
-        prn_r = await client.get(f"{OCTO_BASE}/api/printer", headers=_octo_headers())
+    async with _OCTO_HTTP.client() as client:
+        # ยิงคู่กัน: เวลารวม ≈ 1 RTT แทน 2
+        job_r, prn_r = await asyncio.gather(
+            client.get(f"{OCTO_BASE}/api/job", headers=_octo_headers()),
+            client.get(f"{OCTO_BASE}/api/printer", headers=_octo_headers()),
+        )
         job_r.raise_for_status(); prn_r.raise_for_status()
         return job_r.json(), prn_r.json()
 
+# รวม poll ที่ซ้อนกัน (หลายแท็บ/Unity/internal ยิงพร้อมกัน) ให้เหลือ fetch เดียวที่กำลังวิ่งอยู่
+_OCTO_FETCH_INFLIGHT: Optional[asyncio.Future] = None
+
+async def _fetch_octo_job_and_printer_shared() -> Tuple[dict, dict]:
+    global _OCTO_FETCH_INFLIGHT
+    fut = _OCTO_FETCH_INFLIGHT
+    if fut is None or fut.done():
+        fut = asyncio.ensure_future(_fetch_octo_job_and_printer())
+        _OCTO_FETCH_INFLIGHT = fut
+    # shield: ผู้เรียนคนหนึ่งหลุด (client disconnect) ต้องไม่ยกเลิก fetch ของคนอื่น
+    return await asyncio.shield(fut)
+
 def _read_octo_temps_payload_sync() -> dict:
     """
     Use httpx's sync client to avoid requiring 'requests' in the environment.
@@ -561,7 +594,7 @@ async def _call_process_next(printer_id: str, force: bool = True) -> dict:
     url = f"{BACKEND_INTERNAL_BASE}/internal/printers/{pid}/queue/process-next"
     if force: url += "?force=1"
     try:
-        async with httpx.AsyncClient(timeout=10) as c:
+        async with _INTERNAL_HTTP.client() as c:
             r = await c.post(url, headers={"X-Admin-Token": ADMIN_TOKEN})
             log.info("[AUTO-CHAIN] POST %s -> %s %s", url, r.status_code, r.text[:200])
             r.raise_for_status()
@@ -586,8 +619,8 @@ async def _notify_job_event(job_id: int, status: str, *, printer_id: str,
     }
     timeout = httpx.Timeout(connect=5.0, read=5.0, write=5.0, pool=5.0)
     try:
-        async with httpx.AsyncClient(timeout=timeout, follow_redirects=False) as c:
-            r = await c.post(url, json=payload, headers=headers)
+        async with _INTERNAL_HTTP.client() as c:
+            r = await c.post(url, json=payload, headers=headers, timeout=timeout)
             logging.info("[OCTO] notify %s → %s %s", status, r.status_code, r.text[:200])
             r.raise_for_status()
             return True
@@ -642,7 +675,7 @@ async def octoprint_job(printer_id: str, force: bool = Query(default=False, desc
         if cached: return cached
 
     try:
-        job, prn = await _fetch_octo_job_and_printer()
+        job, prn = await _fetch_octo_job_and_printer_shared()
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 502:
             _OCTO_COOLDOWN_UNTIL[pid] = now_ts + OCTO_502_COOLDOWN
@@ -694,7 +727,7 @@ async def octoprint_job(printer_id: str, force: bool = Query(default=False, desc
                     matched.status = "processing"
                     if not matched.started_at:
                         matched.started_at = now
-                    db.add(matched); db.commit(); db.refresh(matched)
+                    db.add(matched); db.commit(); db.refresh(matched); invalidate_active_owner(pid)
                     log.info("[AUTO-HEAL] attach queued #%s ('%s')", matched.id, matched.name)
                 else:
                     _create_pseudo_job(db, pid, cur_name or "(Printing)")
@@ -752,7 +785,7 @@ async def octoprint_job(printer_id: str, force: bool = Query(default=False, desc
                                     if not closed.started_at:
                                         closed.started_at = datetime.utcnow()
                                     closed.progress = 100.0
-                                    db.add(closed); db.commit(); db.refresh(closed)
+                                    db.add(closed); db.commit(); db.refresh(closed); invalidate_active_owner(pid)
                                 else:
                                     closed = _complete_latest_processing_job(db, pid, status="completed")
 
@@ -797,7 +830,7 @@ async def octoprint_command(
             raise HTTPException(422, "pause action must be 'pause' or 'resume' or 'toggle'")
         payload["action"] = action
     try:
-        async with httpx.AsyncClient(timeout=OCTO_TIMEOUT) as client:
+        async with _OCTO_HTTP.client() as client:
             r = await client.post(f"{OCTO_BASE}/api/job",
                                   headers={**_octo_headers(), "Content-Type": "application/json"},
                                   json=payload)
@@ -894,7 +927,7 @@ async def octoprint_set_feedrate(printer_id: str, body: dict = Body(..., example
     if factor < 10 or factor > 200:
         raise HTTPException(422, "factor must be 10–200 (%)")
     try:
-        async with httpx.AsyncClient(timeout=OCTO_TIMEOUT) as client:
+        async with _OCTO_HTTP.client() as client:
             r = await client.post(f"{OCTO_BASE}/api/printer/printhead",
                                   headers={**_octo_headers(), "Content-Type": "application/json"},
                                   json={"command": "feedrate", "factor": factor})
@@ -990,7 +1023,7 @@ async def octoprint_webhook(printer_id: str, request: Request, db: Session = Dep
                 matched.status = "processing"
                 if not matched.started_at:
                     matched.started_at = now
-                db.add(matched); db.commit(); db.refresh(matched)
+                db.add(matched); db.commit(); db.refresh(matched); invalidate_active_owner(pid)
                 log.info("[WEBHOOK] PrintStarted → attach queued #%s ('%s')", matched.id, matched.name)
             else:
                 _create_pseudo_job(db, pid, file_name or "(Printing)")
@@ -1035,7 +1068,7 @@ async def octoprint_webhook(printer_id: str, request: Request, db: Session = Dep
             job.status = "processing"
             if not job.started_at:
                 job.started_at = datetime.utcnow()
-            db.add(job); db.commit(); db.refresh(job)
+            db.add(job); db.commit(); db.refresh(job); invalidate_active_owner(pid)
             log.info("[WEBHOOK] PrintResumed → job #%s resumed (%s)", job.id, job.name)
 
     return p_out
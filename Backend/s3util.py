@@ -6,6 +6,7 @@ import re
 import uuid
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, Optional, List, Iterable, Tuple
 from urllib.parse import urlparse, urlunparse
@@ -290,9 +291,20 @@ def object_exists(object_key: str) -> bool:
     except Exception:
         return False
 
-def _move_object(src: str, dst: str):
-    copy_object(src_key=src, dst_key=dst)
-    delete_object(src)
+# S3 copy ฝั่ง server รอ network ล้วน → ยิงหลายคู่พร้อมกัน (boto3 client ใช้ข้าม thread ได้)
+# ไม่ควรเกิน max_pool_connections ของ client (ค่าเริ่มต้น 10)
+S3_COPY_WORKERS = max(1, int(os.getenv("S3_COPY_WORKERS", "8")))
+
+def _copy_many(pairs: List[Tuple[str, str]]) -> None:
+    """copy (src, dst) หลายคู่พร้อมกัน; คู่ไหนพังจะ raise หลังทุกคู่จบ → caller ยังไม่ลบต้นทาง"""
+    if not pairs:
+        return
+    if len(pairs) == 1:
+        copy_object(src_key=pairs[0][0], dst_key=pairs[0][1])
+        return
+    with ThreadPoolExecutor(max_workers=min(S3_COPY_WORKERS, len(pairs))) as ex:
+        for _ in ex.map(lambda p: copy_object(src_key=p[0], dst_key=p[1]), pairs):
+            pass
 
 def staging_triple_keys(model: str, job_name: str) -> Dict[str, str]:
     """
@@ -333,9 +345,13 @@ def commit_triple_to_catalog(model: str, job_name: str, tmp: Dict[str, str]) ->
         if not object_exists(tmp[k]):
             raise RuntimeError(f"TRIPLE_INCOMPLETE: missing {k}")
 
-    _move_object(tmp["gcode_tmp"],   final["gcode"])
-    _move_object(tmp["json_tmp"],    final["json"])
-    _move_object(tmp["preview_tmp"], final["preview"])
+    # copy ทั้งสามพร้อมกัน ครบแล้วค่อยลบต้นทางใน request เดียว (copy พังตัวไหน = ยังไม่ลบอะไรเลย)
+    _copy_many([
+        (tmp["gcode_tmp"],   final["gcode"]),
+        (tmp["json_tmp"],    final["json"]),
+        (tmp["preview_tmp"], final["preview"]),
+    ])
+    delete_objects([tmp["gcode_tmp"], tmp["json_tmp"], tmp["preview_tmp"]])
 
     return final
 
@@ -556,10 +572,7 @@ def move_prefix(src_prefix: str, dst_prefix: str) -> int:
     objs = list_objects(Prefix=sp)
     if not objs:
         return 0
-    for o in objs:
-        src = o["Key"]
-        dst = dp + src[len(sp):]
-        copy_object(src_key=src, dst_key=dst)
+    _copy_many([(o["Key"], dp + o["Key"][len(sp):]) for o in objs])
     delete_objects([o["Key"] for o in objs])
     return len(objs)
 
@@ -1,8 +1,9 @@
 # backend/schemas.py
 from __future__ import annotations
 
+import threading
 from datetime import datetime
-from typing import Any, Dict, List, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional, Tuple
 
 from pydantic import BaseModel, ConfigDict, Field, model_validator
 
@@ -31,6 +32,40 @@ class UserOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+# cache UserOut ที่ validate แล้ว: key = ค่าทุกฟิลด์ที่ UserOut อ่านจาก ORM
+# ผู้ใช้ที่ข้อมูลไม่เปลี่ยน → ได้ object เดิม ไม่ต้องผ่าน Pydantic ซ้ำ
+# (แก้ชื่อ/อีเมล/สิทธิ์ → key เปลี่ยนเอง จึงไม่ต้อง invalidate)
+_USEROUT_FIELDS = tuple(UserOut.model_fields)
+_USEROUT_CACHE: Dict[tuple, Tuple[UserOut, bytes]] = {}
+_USEROUT_CACHE_MAX = 4096
+# /auth/login (def ธรรมดา) กับ _save_me (run_in_threadpool) เรียกพร้อมกันจากหลาย thread
+_USEROUT_LOCK = threading.Lock()
+
+
+def _userout_entry(user: Any) -> Tuple[UserOut, bytes]:
+    key = tuple(getattr(user, f, None) for f in _USEROUT_FIELDS)
+    with _USEROUT_LOCK:
+        entry = _USEROUT_CACHE.get(key)
+    if entry is not None:
+        return entry
+    out = UserOut.model_validate(user)
+    entry = (out, out.model_dump_json().encode())
+    with _USEROUT_LOCK:
+        if len(_USEROUT_CACHE) >= _USEROUT_CACHE_MAX:
+            _USEROUT_CACHE.pop(next(iter(_USEROUT_CACHE)), None)
+        _USEROUT_CACHE[key] = entry
+    return entry
+
+
+def userout_for(user: Any) -> UserOut:
+    return _userout_entry(user)[0]
+
+
+def userout_json_for(user: Any) -> bytes:
+    """UserOut ที่ serialize เป็น JSON ไว้แล้ว (ใช้ส่งตรงโดยไม่ผ่าน response_model ซ้ำ)"""
+    return _userout_entry(user)[1]
+
+
 class LoginIn(BaseModel):
     employee_id: str = Field(..., examples=["123456", "1234567"])
 
@@ -21,10 +21,15 @@ def main():
           AND finished_at < ?
           AND status IN ('completed','failed','canceled')
     """, (cutoff_str,))
-    print("Deleted old print_jobs:", cur.rowcount)
+    deleted = cur.rowcount
+    print("Deleted old print_jobs:", deleted)
 
     conn.commit()
-    conn.execute("VACUUM;")
+    # VACUUM เขียนไฟล์ DB ใหม่ทั้งไฟล์ → ทำเฉพาะเมื่อมีแถวถูกลบจริง
+    # ANALYZE ต่อท้าย ให้สถิติของ index (status/finished_at/gcode_key) ตรงกับขนาดตารางหลังลบ
+    if deleted > 0:
+        conn.execute("VACUUM;")
+        conn.execute("ANALYZE print_jobs;")
     conn.close()
 
 if __name__ == "__main__":
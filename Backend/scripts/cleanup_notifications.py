@@ -28,9 +28,13 @@ def main():
 
     conn.commit()
 
-    # จัดระเบียบไฟล์ DB ให้เล็กลง
-    print("Running VACUUM ...")
-    conn.execute("VACUUM;")
+    # จัดระเบียบไฟล์ DB ให้เล็กลง (ไม่มีอะไรถูกลบ = ไม่ต้องเขียนไฟล์ใหม่ทั้งไฟล์)
+    if to_delete > 0:
+        print("Running VACUUM ...")
+        conn.execute("VACUUM;")
+        # สถิติ index ของตารางที่เพิ่งลบ → planner เลือก index ได้ตรงกับขนาดจริง
+        conn.execute("ANALYZE notifications;")
+        conn.execute("ANALYZE notification_targets;")
     conn.close()
     print("Done.")
 
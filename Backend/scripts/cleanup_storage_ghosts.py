@@ -22,7 +22,7 @@ except Exception:
 # ----- App imports -----
 from db import SessionLocal  # type: ignore
 from models import StorageFile, PrintJob  # type: ignore
-from s3util import head_object  # type: ignore
+from s3util import list_objects  # type: ignore
 
 log = logging.getLogger("cleanup_storage_ghosts")
 if not log.handlers:
@@ -32,18 +32,25 @@ if not log.handlers:
 log.setLevel(logging.INFO)
 
 
-def s3_exists(key: str) -> bool:
+def list_existing_keys() -> set[str]:
+    """
+    ดึง key ทั้งหมดใต้ storage/ และ catalog/ ด้วย list_objects (หน้าละ 1000 key)
+    ครั้งเดียวตอนเริ่ม แทนการ HEAD ทีละแถว (N แถว = N round-trip)
+    """
+    keys: set[str] = set()
+    for prefix in ("storage/", "catalog/"):
+        keys.update(o["Key"] for o in list_objects(Prefix=prefix))
+    return keys
+
+
+def s3_exists(key: str, existing: set[str]) -> bool:
     """Return True if object exists in S3/MinIO, False otherwise."""
     if not key or key.startswith(("http://", "https://")):
         return False
-    try:
-        _ = head_object(key)
-        return True
-    except Exception:
-        return False
+    return key in existing
 
 
-def find_ghost_storage_files(db) -> list[StorageFile]:
+def find_ghost_storage_files(db, existing: set[str]) -> list[StorageFile]:
     ghosts: list[StorageFile] = []
     rows: Iterable[StorageFile] = db.query(StorageFile).all()
     for r in rows:
@@ -51,12 +58,12 @@ def find_ghost_storage_files(db) -> list[StorageFile]:
             # แถวหลุดหรือ key แปลก ๆ ก็นับเป็น ghost
             ghosts.append(r)
             continue
-        if not s3_exists(r.object_key):
+        if not s3_exists(r.object_key, existing):
             ghosts.append(r)
     return ghosts
 
 
-def find_garbage_jobs(db) -> list[PrintJob]:
+def find_garbage_jobs(db, existing: set[str]) -> list[PrintJob]:
     """
     กวาด PrintJob แปลก ๆ ที่ทำให้เห็นรายการ 'storage' ใน History:
       - ชื่อ 'storage' และไม่มี gcode_path
@@ -70,7 +77,7 @@ def find_garbage_jobs(db) -> list[PrintJob]:
         if name == "storage" and not gk:
             out.append(j)
             continue
-        if gk and gk.startswith(("storage/", "catalog/")) and not s3_exists(gk):
+        if gk and gk.startswith(("storage/", "catalog/")) and not s3_exists(gk, existing):
             out.append(j)
     return out
 
@@ -88,8 +95,10 @@ def main() -> None:
 
     db = SessionLocal()
     try:
-        ghosts = find_ghost_storage_files(db)
-        garb_jobs = find_garbage_jobs(db)
+        existing = list_existing_keys()
+        log.debug("S3 keys under storage/ + catalog/: %d", len(existing))
+        ghosts = find_ghost_storage_files(db, existing)
+        garb_jobs = find_garbage_jobs(db, existing)
 
         log.info("พบ Storage ghost %d แถว และ PrintJob ขยะ %d แถว", len(ghosts), len(garb_jobs))
 
@@ -463,6 +463,8 @@ function AuthedApp({ user }) {
         if (Date.now() - last < limitMs) return;
         bellLimiterRef.current.set(dedupeKey, Date.now());
       }
+      // response = 1 รายการต่อผู้รับ แต่ทุกรายการใช้ notification id เดียวกัน → อย่าใช้ id เป็น key
+      // (bell จะได้รายการจริงผ่าน /notifications/stream + list อยู่แล้ว จึงไม่ใช้ response ตรงนี้)
       await api.post('/notifications', { type, title, message, severity });
     } catch (err) {
       console.debug('notifyBell failed:', err);